@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the NumPy implementations of pyll symbols.
+
+Each benchmark times the current implementation and, where one existed,
+the pure-Python implementation it replaced.
+
+    python benchmarks/bench_symbols.py
+"""
+import timeit
+
+import numpy as np
+
+from pyll import base, scope, as_apply, rec_eval
+
+
+def old_array_union(a, b):
+    sa = set(a)
+    sa.update(b)
+    return np.asarray(sorted(sa))
+
+
+def old_bincount_slow(x, weights=None, minlength=None):
+    if minlength is None:
+        rlen = np.max(x) + 1
+    else:
+        rlen = max(np.max(x) + 1, minlength)
+    rval = np.zeros(rlen, dtype='int')
+    for xi in np.asarray(x).flatten():
+        rval[xi] += 1
+    return rval
+
+
+def old_where(cond, x, y):
+    return [xi if ci else yi for ci, xi, yi in zip(cond, x, y)]
+
+
+def old_switch(index, *choices):
+    return [choices[ii][jj] for jj, ii in enumerate(index)]
+
+
+def old_clip(a, lo, hi):
+    return [min(max(ai, lo), hi) for ai in a]
+
+
+def old_concatenate(arrays):
+    rval = []
+    for arr in arrays:
+        rval.extend(arr)
+    return rval
+
+
+def old_take(a, indices):
+    return [a[ii] for ii in indices]
+
+
+def bench(name, new, old=None, number=20):
+    t_new = min(timeit.repeat(new, number=number, repeat=3)) / number
+    if old is None:
+        print '%-14s %10.2f us' % (name, t_new * 1e6)
+    else:
+        t_old = min(timeit.repeat(old, number=number, repeat=3)) / number
+        print '%-14s %10.2f us  (was %10.2f us, %6.1fx)' % (
+                name, t_new * 1e6, t_old * 1e6, t_old / t_new)
+
+
+def main():
+    rng = np.random.RandomState(0)
+    n = 100000
+    a = rng.randint(n, size=n)
+    b = rng.randint(n, size=n)
+    x = rng.rand(n)
+    y = rng.rand(n)
+    idx = rng.randint(3, size=n)
+    small = rng.randint(100, size=n)
+
+    bench('array_union', lambda: base.array_union(a, b),
+            lambda: old_array_union(a, b))
+    bench('_bincount_slow', lambda: base._bincount_slow(small, minlength=5),
+            lambda: old_bincount_slow(small, minlength=5))
+    bench('bincount', lambda: base.bincount(small, minlength=5))
+    bench('repeat', lambda: base.repeat(n, 1.0))
+    bench('where', lambda: base.where(x > .5, x, y),
+            lambda: old_where(x > .5, x, y))
+    bench('switch', lambda: base.switch(idx, x, y, x + y),
+            lambda: old_switch(idx, x, y, x + y))
+    bench('clip', lambda: base.clip(x, .2, .8),
+            lambda: old_clip(x, .2, .8))
+    bench('concatenate', lambda: base.concatenate([x, y]),
+            lambda: old_concatenate([x, y]))
+    bench('take', lambda: base.take(x, a), lambda: old_take(x, a))
+    # -- symbol dispatch through rec_eval, for reference; getitem and len
+    #    are a single C-level operation already
+    node = scope.getitem(as_apply(x), 5)
+    bench('rec_eval getitem', lambda: rec_eval(node), number=10000)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,14 @@ from base import Literal
 from base import as_apply
 from base import scope
 from base import rec_eval
+from base import rec_eval_many
+from base import vmap
 from base import clone
+from base import prune
+from base import substitute
 from base import dfs
+from base import graph_index
+from base import fingerprint
 
 # -- adds symbols to scope
 import stochastic
@@ -4,6 +4,9 @@
 #
 
 from StringIO import StringIO
+import cPickle
+import hashlib
+import weakref
 
 # TODO: move things depending on numpy (among others too) to a library file
 import numpy as np
@@ -49,8 +52,12 @@ class SymbolTable(object):
         return self._new_apply('list', [as_apply(init)], {}, o_len=None)
 
     def dict(self, *args, **kwargs):
-        # XXX: figure out len
-        return self._new_apply('dict', args, kwargs, o_len=None)
+        # -- positional args are iterables of items, of unknown length
+        if args:
+            o_len = None
+        else:
+            o_len = len(kwargs)
+        return self._new_apply('dict', args, kwargs, o_len=o_len)
 
     def range(self, *args):
         return self._new_apply('range', args, {}, o_len=None)
@@ -79,11 +86,35 @@ class SymbolTable(object):
 scope = SymbolTable()
 
 
+# -- lists and tuples of at least this many plain constants are stored as a
+#    single Literal rather than a pos_args node with one Literal per element.
+LITERAL_BULK_LEN = 1000
+
+# -- Literal values with more elements than this are summarized by pprint
+PPRINT_MAX_ITEMS = 20
+
+# -- other Literal values are truncated to this many characters by pprint
+PPRINT_MAX_CHARS = 200
+
+_plain_constant_types = (bool, int, long, float, complex, basestring,
+        np.number, np.bool_, type(None))
+
+
 def as_apply(obj):
     """Smart way of turning object into an Apply
+
+    Long lists and tuples of plain constants (numbers, strings, None) become a
+    single Literal holding a tuple, which evaluates to the same value as the
+    equivalent pos_args node. NumPy arrays are always held by reference.
     """
     if isinstance(obj, Apply):
         rval = obj
+    elif (isinstance(obj, (tuple, list))
+            and len(obj) >= LITERAL_BULK_LEN
+            and all(isinstance(a, _plain_constant_types) for a in obj)):
+        if isinstance(obj, list):
+            obj = tuple(obj)
+        rval = Literal(obj)
     elif isinstance(obj, tuple):
         rval = Apply('pos_args', [as_apply(a) for a in obj], {}, len(obj))
     elif isinstance(obj, list):
@@ -147,6 +178,13 @@ class Apply(object):
             return rval
 
 
+    def __getstate__(self):
+        # -- graph indexes are caches local to this process, and they would
+        #    go stale in a copy; they are rebuilt on demand.
+        state = dict(self.__dict__)
+        state.pop('_graph_index', None)
+        return state
+
     def inputs(self):
         rval = self.pos_args + [v for (k, v) in self.named_args]
         assert all(isinstance(arg, Apply) for arg in rval)
@@ -174,6 +212,8 @@ class Apply(object):
             if aa is old_node:
                 self.named_args[ii][1] = new_node
                 rval.append(ii + len(self.pos_args))
+        if rval:
+            inputs_changed(self)
         return rval
 
     def pprint(self, ofile, lineno=None, indent=0, memo=None):
@@ -182,19 +222,28 @@ class Apply(object):
         if lineno is None:
             lineno = [0]
 
-        if self in memo:
-            print >> ofile, lineno[0], ' ' * indent + memo[self]
-            lineno[0] += 1
-        else:
-            memo[self] = self.name + ('  [line:%i]' % lineno[0])
-            print >> ofile, lineno[0], ' ' * indent + self.name
+        # -- iterative, so that deep graphs do not hit the recursion limit;
+        #    the stack holds nodes to print and named-arg header lines.
+        todo = [(self, indent)]
+        while todo:
+            node, indent = todo.pop()
+            if isinstance(node, basestring):
+                print >> ofile, lineno[0], node
+            elif node in memo:
+                print >> ofile, lineno[0], ' ' * indent + memo[node]
+            elif isinstance(node, Literal):
+                msg = 'Literal{%s}' % _literal_summary(node._obj)
+                memo[node] = '%s  [line:%i]' % (msg, lineno[0])
+                print >> ofile, lineno[0], ' ' * indent + msg
+            else:
+                memo[node] = node.name + ('  [line:%i]' % lineno[0])
+                print >> ofile, lineno[0], ' ' * indent + node.name
+                for name, arg in reversed(node.named_args):
+                    todo.append((arg, indent + 2))
+                    todo.append((' ' * indent + ' ' + name + ' =', None))
+                for arg in reversed(node.pos_args):
+                    todo.append((arg, indent + 2))
             lineno[0] += 1
-            for arg in self.pos_args:
-                arg.pprint(ofile, lineno, indent + 2, memo)
-            for name, arg in self.named_args:
-                print >> ofile, lineno[0], ' ' * indent + ' ' + name + ' ='
-                lineno[0] += 1
-                arg.pprint(ofile, lineno, indent + 2, memo)
 
     def __str__(self):
         sio = StringIO()
@@ -258,19 +307,6 @@ class Literal(Apply):
     def obj(self):
         return self._obj
 
-    def pprint(self, ofile, lineno=None, indent=0, memo=None):
-        if lineno is None:
-            lineno = [0]
-        if memo is None:
-            memo = {}
-        if self in memo:
-            print >> ofile, lineno[0], ' ' * indent + memo[self]
-        else:
-            msg = 'Literal{%s}' % str(self._obj)
-            memo[self] =  '%s  [line:%i]' % (msg, lineno[0])
-            print >> ofile, lineno[0], ' ' * indent + msg
-        lineno[0] += 1
-
     def replace_input(self, old_node, new_node):
         return []
 
@@ -278,6 +314,51 @@ class Literal(Apply):
         return self.__class__(self._obj)
 
 
+def _literal_summary(obj, depth=0):
+    """Return a string of bounded length describing a Literal value
+
+    The cost is bounded as well: sequences are summarized element by element
+    until PPRINT_MAX_CHARS are used up, large arrays by shape and dtype, and
+    dicts and other objects by type and length, without formatting them.
+    """
+    if isinstance(obj, np.ndarray):
+        if (obj.size > PPRINT_MAX_ITEMS or obj.dtype == object
+                or obj.dtype.itemsize > PPRINT_MAX_CHARS):
+            return 'array(shape=%s, dtype=%s)' % (obj.shape, obj.dtype)
+        rval = repr(obj) if depth else str(obj)
+    elif isinstance(obj, (list, tuple)):
+        brackets = '[]' if isinstance(obj, list) else '()'
+        if depth >= 3:
+            return '%s... <%i items>%s' % (brackets[0], len(obj), brackets[1])
+        n_shown = 3 if len(obj) > PPRINT_MAX_ITEMS else len(obj)
+        parts = []
+        n_chars = 0
+        for a in obj[:n_shown]:
+            if n_chars > PPRINT_MAX_CHARS:
+                break
+            parts.append(_literal_summary(a, depth + 1))
+            n_chars += len(parts[-1]) + 2
+        if len(parts) < len(obj):
+            parts.append('... <%i items>' % len(obj))
+        elif isinstance(obj, tuple) and len(obj) == 1:
+            parts[0] += ','
+        rval = '%s%s%s' % (brackets[0], ', '.join(parts), brackets[1])
+    elif isinstance(obj, basestring):
+        head = obj[:PPRINT_MAX_CHARS + 1]
+        rval = repr(head) if depth else str(head)
+    elif obj is None or isinstance(obj, (bool, int, long, float, complex,
+            np.number, np.bool_)):
+        rval = repr(obj) if depth else str(obj)
+    else:
+        try:
+            return '<%s of %i items>' % (type(obj).__name__, len(obj))
+        except TypeError:
+            return '<%s>' % type(obj).__name__
+    if len(rval) > PPRINT_MAX_CHARS:
+        rval = rval[:PPRINT_MAX_CHARS] + '...'
+    return rval
+
+
 def dfs(aa, seq=None, seqset=None):
     if seq is None:
         assert seqset is None
@@ -307,14 +388,342 @@ def clone(expr, memo=None):
     return memo[expr]
 
 
+def prune(expr, keep):
+    """
+    Return clones of the `keep` nodes of expr, without the rest of expr.
+
+    keep - list of nodes of the graph of expr; when expr is a dict node,
+        strings select the entries of expr with those keys.
+
+    The clones share one copy of the subgraph they have in common, and
+    nothing of expr that they do not depend on is copied.
+    """
+    index = set(dfs(expr))
+    named = dict(expr.named_args) if expr.name == 'dict' else {}
+    nodes = []
+    for node in keep:
+        if isinstance(node, basestring):
+            node = named[node]
+        if node not in index:
+            raise ValueError('node is not part of expr', node)
+        nodes.append(node)
+    memo = {}
+    return [clone(node, memo) for node in nodes]
+
+
+def substitute(expr, replacements):
+    """
+    Return a copy of expr in which the nodes of replacements (a dict from old
+    nodes to new nodes or values) are replaced.
+
+    expr itself is not modified. Only the nodes that depend on a replaced
+    node are rebuilt; all other nodes are shared between expr and the
+    result, so with the GraphIndex of expr in place the cost is proportional
+    to the number of rebuilt nodes, not to the size of expr.
+    """
+    index = graph_index(expr)
+    memo = dict((old, as_apply(new)) for old, new in replacements.items())
+    affected = set()
+    todo = [node for node in memo if node in index]
+    while todo:
+        for node in index.consumers(todo.pop()):
+            if node not in affected and node not in memo:
+                affected.add(node)
+                todo.append(node)
+    # -- depth increases along consumers, so inputs are rebuilt first
+    for node in sorted(affected, key=index.depth):
+        memo[node] = node.clone_from_inputs(
+                [memo.get(ii, ii) for ii in node.inputs()])
+    return memo.get(expr, expr)
+
+
+class GraphIndex(object):
+    """
+    Index of the nodes reachable from `root`.
+
+    Provides the nodes with a given symbol name, the consumers of each node,
+    and the depth of each node (0 for nodes without inputs, otherwise one
+    more than the deepest input). Queries cost O(size of the result).
+
+    Use `graph_index(root)` to get the index cached on a root. The index
+    follows `Apply.replace_input`; other in-place edits of a node's pos_args
+    or named_args must be followed by `inputs_changed(node)`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._inputs = {}
+        self._consumers = {}
+        self._depth = {}
+        self._by_name = {}
+        # -- the one weakref to this index held by the registry entries
+        self._ref = weakref.ref(self, _forget_index)
+        _index_node_ids[self._ref] = []
+        for node in dfs(root):
+            self._add(node)
+
+    def __contains__(self, node):
+        return node in self._inputs
+
+    def __len__(self):
+        return len(self._inputs)
+
+    def by_name(self, names):
+        """Return the nodes whose name is `names` (a string) or in `names`
+        """
+        if isinstance(names, basestring):
+            names = [names]
+        rval = []
+        for name in names:
+            rval.extend(self._by_name.get(name, ()))
+        return rval
+
+    def consumers(self, node):
+        return list(self._consumers.get(node, ()))
+
+    def depth(self, node):
+        return self._depth[node]
+
+    def update(self, node):
+        """Bring the index up to date after node's inputs have changed
+        """
+        if node not in self._inputs:
+            return
+        old_inputs = self._inputs[node]
+        new_inputs = self._inputs[node] = node.inputs()
+        for ii in set(new_inputs).difference(old_inputs):
+            if ii not in self._inputs:
+                self._add_subgraph(ii)
+            self._consumers.setdefault(ii, []).append(node)
+        for ii in set(old_inputs).difference(new_inputs):
+            self._consumers[ii].remove(node)
+            self._discard_orphans(ii)
+        self._update_depth(node)
+
+    def _add(self, node):
+        # -- plain dicts and lists throughout, this runs for every node
+        _register_index(id(node), self._ref)
+        if node.pos_args or node.named_args:
+            # -- node.inputs() without its checks
+            inputs = node.pos_args + [v for k, v in node.named_args]
+        else:
+            inputs = ()
+        self._inputs[node] = inputs
+        by_name = self._by_name
+        if node.name in by_name:
+            by_name[node.name].append(node)
+        else:
+            by_name[node.name] = [node]
+        consumers = self._consumers
+        depth_of = self._depth
+        depth = 0
+        for ii in inputs:
+            # -- consumers lists are created lazily, leaves have none
+            if ii in consumers:
+                if consumers[ii][-1] is not node:
+                    consumers[ii].append(node)
+            else:
+                consumers[ii] = [node]
+            if depth_of[ii] >= depth:
+                depth = depth_of[ii] + 1
+        depth_of[node] = depth
+
+    def _add_subgraph(self, node):
+        # -- post-order walk that stops at nodes already in the index
+        todo = [node]
+        while todo:
+            aa = todo[-1]
+            if aa in self._inputs:
+                todo.pop()
+                continue
+            waiting_on = [ii for ii in aa.inputs() if ii not in self._inputs]
+            if waiting_on:
+                todo.extend(waiting_on)
+            else:
+                todo.pop()
+                self._add(aa)
+
+    def _discard_orphans(self, node):
+        todo = [node]
+        while todo:
+            aa = todo.pop()
+            if (aa is self.root or aa not in self._inputs
+                    or self._consumers.get(aa)):
+                continue
+            for ii in set(self._inputs.pop(aa)):
+                self._consumers[ii].remove(aa)
+                todo.append(ii)
+            self._consumers.pop(aa, None)
+            del self._depth[aa]
+            self._by_name[aa.name].remove(aa)
+            _unregister_index(id(aa), self._ref)
+
+    def _update_depth(self, node):
+        todo = [node]
+        while todo:
+            aa = todo.pop()
+            inputs = self._inputs[aa]
+            if inputs:
+                depth = 1 + max(self._depth[ii] for ii in inputs)
+            else:
+                depth = 0
+            if depth != self._depth[aa]:
+                self._depth[aa] = depth
+                todo.extend(self._consumers.get(aa, ()))
+
+
+# -- id(node) -> weakref of the GraphIndex containing node (or a tuple of
+#    them), so that in-place edits of a node update only the indexes it is
+#    in. An index holds its nodes, so their ids stay valid while it lives.
+_index_registry = {}
+
+# -- weakref of each live index -> ids of the nodes it registered
+_index_node_ids = {}
+
+
+def _register_index(node_id, ref):
+    refs = _index_registry.get(node_id)
+    if refs is None:
+        _index_registry[node_id] = ref
+    elif isinstance(refs, tuple):
+        _index_registry[node_id] = refs + (ref,)
+    else:
+        _index_registry[node_id] = (refs, ref)
+    _index_node_ids[ref].append(node_id)
+
+
+def _unregister_index(node_id, ref):
+    refs = _index_registry.get(node_id)
+    if refs is ref:
+        del _index_registry[node_id]
+    elif isinstance(refs, tuple) and ref in refs:
+        refs = tuple(r for r in refs if r is not ref)
+        _index_registry[node_id] = refs if len(refs) > 1 else refs[0]
+
+
+def _forget_index(ref):
+    for node_id in _index_node_ids.pop(ref, ()):
+        _unregister_index(node_id, ref)
+
+
+def graph_index(root):
+    """Return the GraphIndex of root, building it on first use
+
+    The index is cached on root for the life of root, but it is not part of
+    root's pickled or copied state.
+    """
+    try:
+        return root._graph_index
+    except AttributeError:
+        root._graph_index = rval = GraphIndex(root)
+        return rval
+
+
+def fingerprint(expr, memo=None):
+    """Return a stable content hash (hex string) of the graph rooted at expr
+
+    The hash covers symbol names, the order of pos_args, named_args sorted by
+    name, and the values of Literals (NumPy arrays by dtype, shape and bytes),
+    so structurally identical graphs get equal fingerprints.
+
+    memo - optional dict from nodes to their hashes, filled in by the call.
+        It can be shared by calls on graphs that are not edited in between.
+    """
+    if memo is None:
+        memo = {}
+    # -- iterative post-order walk, shared subgraphs are hashed once
+    todo = [expr]
+    while todo:
+        aa = todo[-1]
+        if aa in memo:
+            todo.pop()
+            continue
+        inputs = aa.pos_args + [v for k, v in aa.named_args]
+        waiting_on = [ii for ii in inputs if ii not in memo]
+        if waiting_on:
+            todo.extend(waiting_on)
+            continue
+        todo.pop()
+        h = hashlib.sha1()
+        h.update('%i:%s' % (len(aa.name), aa.name))
+        if isinstance(aa, Literal):
+            _update_hash(h, aa._obj)
+        else:
+            h.update('(%i' % len(aa.pos_args))
+            for ii in aa.pos_args:
+                h.update(memo[ii])
+            for kw, ii in sorted(aa.named_args, key=lambda kv: kv[0]):
+                h.update('%i:%s=' % (len(kw), kw))
+                h.update(memo[ii])
+        memo[aa] = h.hexdigest()
+    return memo[expr]
+
+
+def _update_hash(h, obj):
+    """Feed a canonical encoding of a Literal value into hashlib object h
+    """
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        h.update('ndarray%s%s' % (obj.dtype.str, obj.shape))
+        h.update(np.ascontiguousarray(obj).tostring())
+    elif isinstance(obj, np.ndarray):
+        h.update('ndarray%s%s' % (obj.dtype.str, obj.shape))
+        _update_hash(h, obj.tolist())
+    elif isinstance(obj, (list, tuple)):
+        h.update('%s%i(' % (type(obj).__name__, len(obj)))
+        for elem in obj:
+            _update_hash(h, elem)
+        h.update(')')
+    elif isinstance(obj, dict):
+        h.update('dict%i(' % len(obj))
+        for key in sorted(obj):
+            _update_hash(h, key)
+            _update_hash(h, obj[key])
+        h.update(')')
+    elif obj is None or isinstance(obj, (bool, int, long, float, complex,
+            basestring, np.number, np.bool_)):
+        h.update('%s:%r' % (type(obj).__name__, obj))
+    else:
+        h.update('%s:' % type(obj).__name__)
+        h.update(cPickle.dumps(obj, 2))
+
+
+def inputs_changed(node):
+    """Update the GraphIndexes containing node after its inputs were edited
+    in place
+    """
+    refs = _index_registry.get(id(node), ())
+    if not isinstance(refs, tuple):
+        refs = (refs,)
+    for ref in refs:
+        index = ref()
+        if index is not None:
+            index.update(node)
+
+
 ################################################################################
 ################################################################################
 
 
-def rec_eval(expr, deepcopy_inputs=False, memo=None):
+def rec_eval(expr, deepcopy_inputs=False, memo=None, tracer=None,
+        cache=None, bindings=None):
     """
     expr - pyll Apply instance to be evaluated
 
+    See rec_eval_many for the other arguments.
+    """
+    return rec_eval_many([expr], deepcopy_inputs=deepcopy_inputs,
+            memo=memo, tracer=tracer, cache=cache, bindings=bindings)[0]
+
+
+def rec_eval_many(exprs, deepcopy_inputs=False, memo=None, tracer=None,
+        cache=None, bindings=None):
+    """
+    Evaluate several expressions in one pass, returning a list of values.
+
+    exprs - list of pyll Apply instances to be evaluated. Intermediate nodes
+        shared between them are evaluated once, and nodes that none of them
+        depends on are not evaluated at all (see also `prune`).
+
     memo - optional dictionary of values to use for particular nodes
 
     deepcopy_inputs - deepcopy inputs to every node prior to calling that
@@ -326,15 +735,33 @@ def rec_eval(expr, deepcopy_inputs=False, memo=None):
         user of said input, then it will not be detected as a potential
         problem.
 
+    tracer - optional pyll.trace.Tracer that records a span for every node
+        function call.
+
+    cache - optional pyll.diskcache.DiskCache that stores the results of
+        nodes of selected (deterministic) symbols across processes.
+
+    bindings - optional dictionary of values for the placeholder nodes
+        (see scope.placeholder), by placeholder name.
+
     """
-    node = as_apply(expr)
+    topnodes = [as_apply(expr) for expr in exprs]
     if memo is None:
         memo = {}
-    for aa in dfs(node):
+    nodes = []
+    seen = set()
+    for node in topnodes:
+        dfs(node, nodes, seen)
+    for aa in nodes:
         if isinstance(aa, Literal):
             memo[aa] = aa._obj
-    todo = [node]
-    topnode = node
+        elif bindings and aa.name == 'placeholder':
+            name = placeholder_name(aa)
+            if name in bindings:
+                memo[aa] = bindings[name]
+    if tracer is not None:
+        tracer.start(nodes)
+    todo = list(reversed(topnodes))
     while todo:
         if len(todo) > 100000:
             raise RuntimeError('Probably infinite loop in document')
@@ -351,8 +778,14 @@ def rec_eval(expr, deepcopy_inputs=False, memo=None):
                     import copy
                     args = copy.deepcopy(_args)
                     kwargs = copy.deepcopy(_kwargs)
+                f = scope._impls[node.name]
+                if cache is not None and node.name in cache.symbols:
+                    f = cache.wrap(node, f)
                 try:
-                    rval = scope._impls[node.name](*args, **kwargs)
+                    if tracer is None:
+                        rval = f(*args, **kwargs)
+                    else:
+                        rval = tracer.call(node, f, args, kwargs)
                 except Exception, e:
                     print '=' * 80
                     print 'ERROR in rec_eval'
@@ -362,12 +795,125 @@ def rec_eval(expr, deepcopy_inputs=False, memo=None):
                     print '=' * 80
                     raise
                 memo[node] = rval
-    return memo[topnode]
+    return [memo[node] for node in topnodes]
+
+
+def placeholder_name(node):
+    """Return the name of a placeholder node
+    """
+    if node.name != 'placeholder':
+        raise TypeError('not a placeholder', node)
+    return node.pos_args[0]._obj
+
+
+def broadcast_rows(values, batched):
+    """
+    Reshape the inputs of a whole-array call over rows so that NumPy
+    broadcasting gives the same values as one call per row.
+
+    values - list of inputs; values[i] holds one value per row along its
+        first axis if batched[i], else it is shared by all rows.
+
+    Shared values get a leading axis of length 1, and the remaining axes of
+    all values are right-aligned as they would be within one row.
+    """
+    arrays = [np.asarray(v) for v in values]
+    ndim = max([a.ndim - 1 if b else a.ndim
+        for a, b in zip(arrays, batched)] + [0])
+    rval = []
+    for a, b in zip(arrays, batched):
+        if b:
+            rval.append(a.reshape(a.shape[:1] + (1,) * (ndim + 1 - a.ndim)
+                + a.shape[1:]))
+        else:
+            rval.append(a.reshape((1,) * (ndim + 1 - a.ndim) + a.shape))
+    return rval
+
+
+def apply_rows(node, args, kwargs, batched, n):
+    """
+    Return the values of node for n rows.
+
+    args and kwargs hold node's inputs; those whose position or key is in
+    `batched` hold one value per row, the others are shared by all rows.
+    Symbols in elementwise_symbols whose batched inputs are all arrays are
+    called once on whole arrays (see broadcast_rows), other symbols once per
+    row (giving a list).
+    """
+    f = scope._impls[node.name]
+    batched_vals = [a for ii, a in enumerate(args) if ii in batched]
+    batched_vals += [v for k, v in kwargs.items() if k in batched]
+    if (node.name in elementwise_symbols
+            and all(isinstance(v, np.ndarray) for v in batched_vals)):
+        keys = range(len(args)) + kwargs.keys()
+        values = broadcast_rows(list(args) + kwargs.values(),
+                [k in batched for k in keys])
+        return f(*values[:len(args)],
+                **dict(zip(keys[len(args):], values[len(args):])))
+    rval = []
+    for rr in xrange(n):
+        r_args = [a[rr] if ii in batched else a for ii, a in enumerate(args)]
+        r_kwargs = dict([(k, v[rr] if k in batched else v)
+            for k, v in kwargs.items()])
+        rval.append(f(*r_args, **r_kwargs))
+    return rval
+
+
+def vmap(expr, bindings):
+    """
+    Evaluate expr for many bindings of its placeholders at once.
+
+    bindings - dictionary from placeholder names to arrays (or lists) of n
+        values each, one per row.
+
+    Nodes that do not depend on the placeholders are evaluated once.
+    Elementwise symbols (see elementwise_symbols) are evaluated once on
+    whole arrays of rows, other symbols row by row. Returns the n values of
+    expr: an array with one row per binding where the computation stayed
+    vectorized, otherwise a list.
+    """
+    expr = as_apply(expr)
+    lens = set(len(v) for v in bindings.values())
+    if len(lens) != 1:
+        raise ValueError('bindings must have the same number of rows', lens)
+    n, = lens
+    memo = {}
+    rows = {}
+    for node in dfs(expr):
+        if isinstance(node, Literal):
+            memo[node] = node._obj
+            continue
+        if node.name == 'placeholder' and placeholder_name(node) in bindings:
+            rows[node] = bindings[placeholder_name(node)]
+            continue
+        args = [rows.get(a, memo.get(a)) for a in node.pos_args]
+        kwargs = dict([(k, rows.get(a, memo.get(a)))
+            for k, a in node.named_args])
+        batched = set(ii for ii, a in enumerate(node.pos_args) if a in rows)
+        batched.update(k for k, a in node.named_args if a in rows)
+        if batched:
+            rows[node] = apply_rows(node, args, kwargs, batched, n)
+        else:
+            memo[node] = scope._impls[node.name](*args, **kwargs)
+    if expr in rows:
+        return rows[expr]
+    return [memo[expr]] * n
 
 
 ################################################################################
 ################################################################################
 
+# -- symbols whose implementation works elementwise on NumPy arrays, so that
+#    batched evaluators can compute many rows with a single call.
+elementwise_symbols = set(['identity', 'add', 'sub', 'mul', 'div', 'exp',
+    'log', 'sqrt', 'where', 'switch', 'clip'])
+
+
+@scope.define
+def placeholder(name):
+    raise KeyError('No binding for placeholder', name)
+
+
 @scope.define
 def pos_args(*args):
     return args
@@ -428,9 +974,14 @@ def sqrt(x):
 
 @scope.define
 def array_union(a, b):
-    sa = set(a)
-    sa.update(b)
-    return np.asarray(sorted(sa))
+    a = np.asarray(a)
+    b = np.asarray(b)
+    # -- an empty operand must not change the dtype of the other one
+    if not a.size:
+        return np.unique(b)
+    if not b.size:
+        return np.unique(a)
+    return np.union1d(a, b)
 
 
 @scope.define
@@ -451,8 +1002,8 @@ def _bincount_slow(x, weights=None, minlength=None):
     else:
         rlen = max(np.max(x) + 1, minlength)
     rval = np.zeros(rlen, dtype='int')
-    for xi in np.asarray(x).flatten():
-        rval[xi] += 1
+    counts = np.bincount(np.asarray(x).flatten())
+    rval[:len(counts)] = counts
     return rval
 
 
@@ -474,3 +1025,29 @@ def bincount(x, weights=None, minlength=None):
 def repeat(n_times, obj):
     return [obj] * n_times
 
+
+@scope.define
+def where(condition, x, y):
+    return np.where(condition, x, y)
+
+
+@scope.define
+def switch(index, *choices):
+    """Elementwise choices[index], like np.choose
+    """
+    return np.choose(index, choices)
+
+
+@scope.define
+def clip(a, a_min, a_max):
+    return np.clip(a, a_min, a_max)
+
+
+@scope.define
+def concatenate(arrays, axis=0):
+    return np.concatenate(arrays, axis=axis)
+
+
+@scope.define
+def take(a, indices, axis=None):
+    return np.take(a, indices, axis=axis)
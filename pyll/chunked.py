@@ -0,0 +1,228 @@
+"""
+Out-of-core evaluation of graphs over large memory-mapped arrays.
+
+Literals holding an np.memmap are treated as data sources that are read
+block by block along their first axis. Elementwise symbols applied to them
+(see base.elementwise_symbols) are computed block by block too, and the
+reductions `sum` (over all elements or axis 0) and `bincount` combine the
+results of the blocks, so peak memory is bounded by the chunk size rather
+than by the size of the data.
+
+    >>> x = as_apply(np.memmap('x.dat', dtype='float64', mode='r'))
+    >>> rec_eval_chunked(scope.sum(scope.exp(x) * 2), chunk_size=2 ** 20)
+"""
+import inspect
+
+import numpy as np
+
+from .base import as_apply, dfs, scope, Apply, Literal, elementwise_symbols
+
+
+def _bound_args(node):
+    """Map the parameter names of node's implementation to input nodes (or
+    to default values)
+    """
+    f = scope._impls[node.name]
+    return inspect.getcallargs(f, *node.pos_args, **dict(node.named_args))
+
+
+def _combine_bincount(total, counts):
+    if total is None:
+        return counts
+    if len(counts) > len(total):
+        total, counts = counts, total
+    total = total.copy()
+    total[:len(counts)] += counts
+    return total
+
+
+class _ChunkedEval(object):
+
+    def __init__(self, chunk_size, memo):
+        self.chunk_size = chunk_size
+        self.memo = memo
+        # -- node -> number of rows, for nodes computed block by block
+        self.n_rows = {}
+        # -- node -> ndim, for the same nodes
+        self.ndim = {}
+        # -- node -> its in-memory inputs that are sliced per block
+        self.sliced = {}
+
+    def is_chunked(self, node):
+        return node in self.n_rows
+
+    def value(self, arg):
+        if isinstance(arg, Apply):
+            return self.memo[arg]
+        return arg
+
+    def row_aligned(self, node, n_rows):
+        """Return the in-memory inputs of elementwise node to slice per block,
+        or None if node cannot be computed block by block
+        """
+        ndims = [self.ndim[ii] if self.is_chunked(ii)
+                else np.ndim(self.memo[ii]) for ii in node.inputs()]
+        ndim = max(ndims)
+        sliced = set()
+        for ii, nd in zip(node.inputs(), ndims):
+            if self.is_chunked(ii):
+                # -- the rows must stay the first axis of the result
+                if nd != ndim:
+                    return None
+            elif nd == ndim:
+                # -- in-memory arrays spanning the row axis are sliced too
+                length = np.shape(self.memo[ii])[0]
+                if length == n_rows:
+                    sliced.add(ii)
+                elif length != 1:
+                    return None
+        self.ndim[node] = ndim
+        return sliced
+
+    def visit(self, node):
+        if node in self.memo:
+            return
+        if isinstance(node, Literal):
+            if isinstance(node._obj, np.memmap) and node._obj.ndim:
+                self.n_rows[node] = len(node._obj)
+                self.ndim[node] = node._obj.ndim
+            else:
+                self.memo[node] = node._obj
+            return
+        chunked = [ii for ii in node.inputs() if self.is_chunked(ii)]
+        if not chunked:
+            self.memo[node] = self.call(node)
+            return
+        n_rows = set(self.n_rows[ii] for ii in chunked)
+        if node.name in elementwise_symbols and len(n_rows) == 1:
+            n_rows = n_rows.pop()
+            sliced = self.row_aligned(node, n_rows)
+            if sliced is not None:
+                self.n_rows[node] = n_rows
+                self.sliced[node] = sliced
+                return
+            n_rows = set([n_rows])
+        if node.name in ('sum', 'bincount'):
+            bound = _bound_args(node)
+        if node.name == 'sum' and self.is_chunked(bound['x']):
+            x = bound['x']
+            axis = self.value(bound['axis'])
+            ndim = self.ndim[x]
+            if isinstance(axis, (int, np.integer)) and -ndim <= axis < ndim:
+                axis = axis % ndim
+            if axis is None or axis == 0:
+                total = None
+                for block in self.blocks(x):
+                    part = np.sum(block, axis=axis)
+                    total = part if total is None else total + part
+                if total is None:
+                    # -- no rows at all
+                    total = np.sum(self.materialize(x), axis=axis)
+                self.memo[node] = total
+                return
+            if isinstance(axis, (int, np.integer)) and 0 < axis < ndim:
+                self.n_rows[node] = self.n_rows[x]
+                self.ndim[node] = ndim - 1
+                self.sliced[node] = set()
+                return
+        if (node.name == 'bincount' and self.is_chunked(bound['x'])
+                and len(n_rows) == 1):
+            n_rows, = n_rows
+            weights = bound['weights']
+            minlength = self.value(bound['minlength'])
+            targets = [bound['x']]
+            if isinstance(weights, Apply) and self.is_chunked(weights):
+                targets.append(weights)
+            elif isinstance(weights, Apply):
+                weights = self.memo[weights]
+            if (weights is None or isinstance(weights, Apply)
+                    or len(weights) == n_rows):
+                total = None
+                lows = xrange(0, n_rows, self.chunk_size)
+                for lo, blocks in zip(lows, self.blocks_many(targets)):
+                    if len(blocks) > 1:
+                        w = blocks[1]
+                    elif weights is not None:
+                        w = weights[lo:lo + len(blocks[0])]
+                    else:
+                        w = None
+                    counts = scope._impls['bincount'](blocks[0], w,
+                            minlength or 0)
+                    total = _combine_bincount(total, counts)
+                if total is None:
+                    total = np.zeros(minlength or 0, dtype='int')
+                elif minlength is not None and len(total) < minlength:
+                    total = _combine_bincount(
+                            np.zeros(minlength, dtype=total.dtype), total)
+                self.memo[node] = total
+                return
+        # -- anything else needs its inputs in memory
+        for ii in chunked:
+            self.memo[ii] = self.materialize(ii)
+        self.memo[node] = self.call(node)
+
+    def call(self, node):
+        args = [self.memo[a] for a in node.pos_args]
+        kwargs = dict([(k, self.memo[a]) for k, a in node.named_args])
+        return scope._impls[node.name](*args, **kwargs)
+
+    def blocks(self, node):
+        for blocks in self.blocks_many([node]):
+            yield blocks[0]
+
+    def blocks_many(self, targets):
+        """Yield, block by block, the values of the chunked targets
+        """
+        nodes = []
+        seen = set()
+        for target in targets:
+            dfs(target, nodes, seen)
+        nodes = [nn for nn in nodes if self.is_chunked(nn)]
+        n_rows = self.n_rows[targets[0]]
+        for lo in xrange(0, n_rows, self.chunk_size):
+            hi = min(lo + self.chunk_size, n_rows)
+            block = {}
+            for nn in nodes:
+                if isinstance(nn, Literal):
+                    block[nn] = nn._obj[lo:hi]
+                    continue
+                sliced = self.sliced[nn]
+                def value(a):
+                    if a in block:
+                        return block[a]
+                    if a in sliced:
+                        return self.memo[a][lo:hi]
+                    return self.memo[a]
+                args = [value(a) for a in nn.pos_args]
+                kwargs = dict([(k, value(a)) for k, a in nn.named_args])
+                block[nn] = scope._impls[nn.name](*args, **kwargs)
+            yield [block[target] for target in targets]
+
+    def materialize(self, node):
+        if isinstance(node, Literal):
+            return node._obj
+        blocks = list(self.blocks(node))
+        if not blocks:
+            return np.zeros(0)
+        return np.concatenate(blocks)
+
+
+def rec_eval_chunked(expr, chunk_size=65536, memo=None):
+    """
+    Evaluate expr, streaming memory-mapped Literals in blocks of chunk_size
+    rows.
+
+    memo - optional dictionary of values to use for particular nodes
+
+    Nodes that depend on memory-mapped data without going through a `sum` or
+    `bincount` reduction (e.g. an elementwise root) are assembled in memory.
+    """
+    expr = as_apply(expr)
+    if memo is None:
+        memo = {}
+    ev = _ChunkedEval(chunk_size, memo)
+    for node in dfs(expr):
+        ev.visit(node)
+    if ev.is_chunked(expr):
+        memo[expr] = ev.materialize(expr)
+    return memo[expr]
@@ -0,0 +1,211 @@
+"""
+Persistent on-disk cache of node results.
+
+    >>> cache = DiskCache('/tmp/pyll_cache', symbols=['load_dataset'])
+    >>> rec_eval(expr, cache=cache)
+
+Only nodes of the listed symbols are cached, so they must be deterministic
+functions of their inputs. The key of a node's result is a hash of the
+node's symbol and of its input values, so a computation is found again no
+matter which subgraph produced those inputs. NumPy
+arrays are stored as .npy files and loaded back as read-only memory maps;
+other results are pickled.
+
+Several processes on one machine can share a cache directory: files are
+written to a temporary name and renamed into place, and writes and
+evictions hold an exclusive lock on the directory's lock file. The total
+size of the files is kept in the directory's size file, so that a write
+only scans the directory when the cache is over max_bytes.
+"""
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # -- no locking, e.g. on Windows
+    fcntl = None
+
+import numpy as np
+
+from .base import _update_hash
+
+
+class DiskCache(object):
+    """
+    path - directory of the cache, created if necessary
+
+    symbols - names of the symbols whose results are cached
+
+    max_bytes - when the files of the cache exceed this size, the least
+        recently used ones are deleted
+    """
+
+    def __init__(self, path, symbols, max_bytes=2 ** 30):
+        self.path = path
+        self.symbols = set(symbols)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, node, args, kwargs):
+        h = hashlib.sha1()
+        h.update('%i:%s' % (len(node.name), node.name))
+        _update_hash(h, list(args))
+        _update_hash(h, kwargs)
+        return h.hexdigest()
+
+    def wrap(self, node, f):
+        """Return a function computing f(*args, **kwargs) through the cache
+        """
+        def cached_f(*args, **kwargs):
+            return self.call(node, f, args, kwargs)
+        return cached_f
+
+    def call(self, node, f, args, kwargs):
+        key = self.key(node, args, kwargs)
+        try:
+            rval = self.load(key)
+        except KeyError:
+            self.misses += 1
+            rval = f(*args, **kwargs)
+            self.store(key, rval)
+        else:
+            self.hits += 1
+        return rval
+
+    def _filename(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def load(self, key):
+        """Return the value stored under key, or raise KeyError
+        """
+        for ext in ('.npy', '.pkl'):
+            fn = self._filename(key, ext)
+            try:
+                if ext == '.npy':
+                    rval = np.load(fn, mmap_mode='r')
+                else:
+                    with open(fn, 'rb') as f:
+                        rval = cPickle.load(f)
+            except (IOError, OSError):
+                # -- missing, or evicted by another process meanwhile
+                continue
+            try:
+                # -- mark as recently used
+                os.utime(fn, None)
+            except OSError:
+                pass
+            return rval
+        raise KeyError(key)
+
+    def store(self, key, value):
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            ext = '.npy'
+        else:
+            ext = '.pkl'
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if ext == '.npy':
+                    np.save(f, value)
+                else:
+                    cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp)
+            with self._lock():
+                # -- overwriting an entry overcounts, which only makes the
+                #    next eviction scan come sooner
+                total = self._read_total() + size
+                os.rename(tmp, self._filename(key, ext))
+                if total > self.max_bytes:
+                    total = self._evict()
+                self._write_total(total)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _lock(self):
+        return _FileLock(os.path.join(self.path, '.lock'))
+
+    def _total_filename(self):
+        return os.path.join(self.path, '.size')
+
+    def _read_total(self):
+        """Return the total size of the cache files (call with the lock)
+        """
+        try:
+            with open(self._total_filename()) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            # -- missing or unreadable: count the files
+            return sum(size for mtime, size, fn in self._entries())
+
+    def _write_total(self, total):
+        with open(self._total_filename(), 'w') as f:
+            f.write('%i' % total)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(('.npy', '.pkl')):
+                continue
+            fn = os.path.join(self.path, name)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+        return entries
+
+    def _evict(self):
+        """Delete the least recently used files until the cache fits in
+        max_bytes, and return the new total size (call with the lock)
+        """
+        entries = self._entries()
+        total = sum(size for mtime, size, fn in entries)
+        entries.sort()
+        for mtime, size, fn in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    def clear(self):
+        with self._lock():
+            for name in os.listdir(self.path):
+                if name.endswith(('.npy', '.pkl')):
+                    os.remove(os.path.join(self.path, name))
+            self._write_total(0)
+
+
+class _FileLock(object):
+    """Exclusive flock on a file, as a context manager
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.filename, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        self.f.close()
+        self.f = None
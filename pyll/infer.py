@@ -0,0 +1,322 @@
+"""
+Static inference of lengths, shapes and dtypes.
+
+    >>> infos = infer(expr)
+    >>> infos[expr].shape, infos[expr].dtype
+    >>> out = allocate(infos[expr])    # -- preallocated output buffer
+
+The pass walks the graph once, calling node implementations only for cheap
+symbols with constant inputs (see foldable_symbols), and raises ValueError
+on shapes that cannot be broadcast or indices out of range, so such errors
+surface before an expensive evaluation.
+"""
+import numpy as np
+
+from .base import as_apply, dfs, scope, Literal
+
+_unknown = object()
+
+
+class Info(object):
+    """
+    What is statically known about the value of a node.
+
+    shape - tuple, or None if the value is not array-like or unknown
+    dtype - np.dtype, or None
+    items - list of Infos for tuples / lists, dict of Infos for dicts
+    value - the value itself if it is a constant
+    """
+
+    def __init__(self, shape=None, dtype=None, items=None, value=_unknown):
+        self.shape = shape
+        self.dtype = dtype
+        self.items = items
+        self.value = value
+
+    @property
+    def o_len(self):
+        if self.items is not None:
+            return len(self.items)
+        if self.shape:
+            return self.shape[0]
+        return None
+
+    @property
+    def is_constant(self):
+        return self.value is not _unknown
+
+    def __repr__(self):
+        return 'Info(shape=%s, dtype=%s, o_len=%s)' % (
+                self.shape, self.dtype, self.o_len)
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, (tuple, list)):
+            return cls(items=[cls.from_value(v) for v in value], value=value)
+        if isinstance(value, dict):
+            return cls(items=dict((k, cls.from_value(v))
+                for k, v in value.items()), value=value)
+        if isinstance(value, (np.ndarray, np.number, int, long, float, bool,
+                complex)):
+            arr = np.asarray(value)
+            return cls(shape=arr.shape, dtype=arr.dtype, value=value)
+        return cls(value=value)
+
+
+infer_rules = {}
+
+# -- cheap deterministic symbols that are evaluated during inference when
+#    all of their inputs are constants
+foldable_symbols = set(['pos_args', 'dict', 'getitem', 'len', 'identity',
+    'add', 'sub', 'mul', 'div', 'int', 'float'])
+
+
+def infer_rule(*names):
+    """Decorator registering f as the inference rule of the symbols `names`
+
+    f is called as f(node, args, kwargs) with the Infos of node's inputs and
+    returns the Info of node's value.
+    """
+    def wrapper(f):
+        for name in names:
+            infer_rules[name] = f
+        return f
+    return wrapper
+
+
+def broadcast_shapes(node, *shapes):
+    """Return the broadcast of shapes, or None if one of them is unknown
+    """
+    if any(shape is None for shape in shapes):
+        return None
+    ndim = max(len(shape) for shape in shapes) if shapes else 0
+    rval = []
+    for ii in range(-ndim, 0):
+        dims = set(shape[ii] for shape in shapes if len(shape) >= -ii)
+        dims.discard(1)
+        if len(dims) > 1:
+            raise ValueError('shapes cannot be broadcast together in %s'
+                    % node.name, shapes)
+        rval.append(dims.pop() if dims else 1)
+    return tuple(rval)
+
+
+def _result_dtype(*dtypes):
+    if any(dtype is None for dtype in dtypes):
+        return None
+    return np.result_type(*dtypes)
+
+
+@infer_rule('pos_args')
+def _infer_pos_args(node, args, kwargs):
+    return Info(items=list(args))
+
+
+@infer_rule('dict')
+def _infer_dict(node, args, kwargs):
+    if args:
+        return Info()
+    return Info(items=dict(kwargs))
+
+
+@infer_rule('getitem')
+def _infer_getitem(node, args, kwargs):
+    obj, idx = args
+    if not idx.is_constant:
+        return Info()
+    idx = idx.value
+    if obj.items is not None:
+        try:
+            return obj.items[idx]
+        except (IndexError, KeyError, TypeError):
+            raise ValueError('invalid index in getitem', idx, obj)
+    if obj.shape is not None and isinstance(idx, (int, long, np.integer)):
+        if not obj.shape:
+            raise ValueError('getitem on a 0-d value', idx)
+        if not -obj.shape[0] <= idx < obj.shape[0]:
+            raise ValueError('index out of bounds in getitem', idx, obj.shape)
+        return Info(shape=obj.shape[1:], dtype=obj.dtype)
+    return Info()
+
+
+@infer_rule('len')
+def _infer_len(node, args, kwargs):
+    return Info(shape=(), dtype=np.dtype(int))
+
+
+@infer_rule('identity')
+def _infer_identity(node, args, kwargs):
+    return args[0]
+
+
+@infer_rule('add', 'sub', 'mul', 'div', 'where', 'clip', 'switch')
+def _infer_elementwise(node, args, kwargs):
+    infos = list(args) + kwargs.values()
+    if node.name in ('where', 'switch'):
+        # -- the condition / index does not contribute to the dtype
+        dtypes = [info.dtype for info in infos[1:]]
+    else:
+        dtypes = [info.dtype for info in infos]
+    return Info(shape=broadcast_shapes(node, *[info.shape for info in infos]),
+            dtype=_result_dtype(*dtypes))
+
+
+@infer_rule('exp', 'log', 'sqrt')
+def _infer_float_elementwise(node, args, kwargs):
+    x, = args
+    return Info(shape=x.shape, dtype=_result_dtype(x.dtype, np.float16))
+
+
+@infer_rule('sum')
+def _infer_sum(node, args, kwargs):
+    x = args[0]
+    axis = args[1] if len(args) > 1 else kwargs.get('axis')
+    if x.dtype is not None:
+        dtype = np.sum(np.zeros(1, dtype=x.dtype)).dtype
+    else:
+        dtype = None
+    if axis is None or axis.value is None:
+        return Info(shape=(), dtype=dtype)
+    if not axis.is_constant or x.shape is None:
+        return Info(dtype=dtype)
+    axis = axis.value
+    if not -len(x.shape) <= axis < len(x.shape):
+        raise ValueError('axis out of bounds in sum', axis, x.shape)
+    shape = list(x.shape)
+    del shape[axis]
+    return Info(shape=tuple(shape), dtype=dtype)
+
+
+@infer_rule('asarray')
+def _infer_asarray(node, args, kwargs):
+    a = args[0]
+    dtype = args[1] if len(args) > 1 else kwargs.get('dtype')
+    if dtype is not None and dtype.is_constant and dtype.value is not None:
+        dtype = np.dtype(dtype.value)
+    else:
+        dtype = a.dtype
+    if a.items is not None and isinstance(a.items, list):
+        inner = [item.shape for item in a.items]
+        if None in inner or len(set(inner)) > 1:
+            return Info(dtype=dtype)
+        if dtype is None:
+            dtype = _result_dtype(*[item.dtype for item in a.items])
+        return Info(shape=(len(a.items),) + (inner[0] if inner else ()),
+                dtype=dtype)
+    return Info(shape=a.shape, dtype=dtype)
+
+
+def _size_shape(kwargs):
+    size = kwargs.get('size')
+    if size is None:
+        return ()
+    if not size.is_constant:
+        return None
+    size = size.value
+    if isinstance(size, (int, long, np.integer)):
+        return (size,)
+    return tuple(size)
+
+
+def _param_shape(info):
+    # -- lists of numbers are parameters too, NumPy converts them to arrays
+    if info.shape is None and isinstance(info.items, list):
+        if all(item.shape == () for item in info.items):
+            return (len(info.items),)
+    return info.shape
+
+
+def _stochastic_rule(dtype):
+    def rule(node, args, kwargs):
+        # -- the implementations always pass size (default ()) to NumPy,
+        #    which requires the parameters to broadcast to size itself
+        shape = _size_shape(kwargs)
+        params = [_param_shape(info) for info in args]
+        params += [_param_shape(info) for k, info in kwargs.items()
+                if k not in ('rng', 'size')]
+        if shape is not None:
+            if broadcast_shapes(node, shape, *params) not in (shape, None):
+                raise ValueError('parameters of %s do not broadcast to size'
+                        % node.name, params, shape)
+        return Info(shape=shape, dtype=np.dtype(dtype))
+    return rule
+
+
+for _name in ('uniform', 'loguniform', 'quniform', 'qloguniform', 'normal',
+        'qnormal', 'lognormal', 'qlognormal'):
+    infer_rules[_name] = _stochastic_rule(float)
+
+
+@infer_rule('randint')
+def _infer_randint(node, args, kwargs):
+    # -- an array of upper bounds is broadcast against size
+    upper = args[0] if args else kwargs.get('upper')
+    shape = _size_shape(kwargs)
+    if upper is None or shape is None:
+        return Info(shape=shape, dtype=np.dtype(int))
+    if isinstance(upper.value, np.ndarray) or upper.value is _unknown:
+        shape = broadcast_shapes(node, shape, _param_shape(upper))
+    elif _param_shape(upper) not in (shape, ()):
+        # -- lists of upper bounds are drawn one per element of size
+        raise ValueError('upper bounds of randint do not match size',
+                _param_shape(upper), shape)
+    return Info(shape=shape, dtype=np.dtype(int))
+
+
+@infer_rule('categorical')
+def _infer_categorical(node, args, kwargs):
+    p = args[0] if args else kwargs.get('p')
+    p_shape = _param_shape(p) if p is not None else None
+    if p_shape is not None and len(p_shape) != 1:
+        raise ValueError('categorical needs a vector of probabilities',
+                p_shape)
+    return Info(shape=_size_shape(kwargs), dtype=np.dtype(int))
+
+
+@infer_rule('one_of')
+def _infer_one_of(node, args, kwargs):
+    shapes = set(info.shape for info in args)
+    dtypes = set(info.dtype for info in args)
+    if len(shapes) == 1 and len(dtypes) == 1 and None not in shapes:
+        return Info(shape=shapes.pop(), dtype=dtypes.pop())
+    return Info()
+
+
+def infer(expr):
+    """Return a dict mapping each node of expr to an Info of its value
+    """
+    expr = as_apply(expr)
+    rval = {}
+    for node in dfs(expr):
+        if isinstance(node, Literal):
+            rval[node] = Info.from_value(node._obj)
+            continue
+        args = [rval[a] for a in node.pos_args]
+        kwargs = dict([(k, rval[a]) for k, a in node.named_args])
+        rule = infer_rules.get(node.name)
+        info = rule(node, args, kwargs) if rule else Info()
+        # -- fold cheap nodes whose inputs are all constants
+        if (node.name in foldable_symbols
+                and all(a.is_constant for a in args)
+                and all(a.is_constant for a in kwargs.values())):
+            try:
+                value = scope._impls[node.name](
+                        *[a.value for a in args],
+                        **dict([(k, a.value) for k, a in kwargs.items()]))
+            except Exception:
+                pass
+            else:
+                folded = Info.from_value(value)
+                if folded.shape is None and folded.items is None:
+                    folded.shape, folded.dtype = info.shape, info.dtype
+                info = folded
+        rval[node] = info
+    return rval
+
+
+def allocate(info):
+    """Return an uninitialized array for a value described by info
+    """
+    if info.shape is None or info.dtype is None:
+        raise ValueError('shape and dtype must be known to allocate', info)
+    return np.empty(info.shape, dtype=info.dtype)
@@ -0,0 +1,235 @@
+"""
+Array-backed representation of pyll graphs.
+
+GraphArrays stores a graph as NumPy arrays (struct of arrays) so that
+whole-graph analyses -- topological order, depth, reachability, consumer
+counts, dependence on stochastic nodes -- run as a handful of vectorized
+operations per level of the graph instead of a Python visit per node.
+
+    >>> ga = GraphArrays.from_apply(expr)
+    >>> ga.depth()
+    >>> expr2 = ga.to_apply()
+"""
+import numpy as np
+
+from .base import Apply, Literal, as_apply
+from .stochastic import implicit_stochastic_symbols
+
+
+def _ranges(starts, ends):
+    """Concatenation of arange(s, e) for s, e in zip(starts, ends)
+    """
+    lengths = ends - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.zeros(0, dtype='intp')
+    shifts = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]),
+            lengths)
+    return shifts + np.arange(total)
+
+
+class GraphArrays(object):
+    """
+    Struct-of-arrays form of a pyll graph with n nodes and m input edges.
+
+    names - list of symbol names; opcode[i] is the index of node i's name
+    opcode - int array (n,)
+    o_len - int array (n,), -1 where the Apply's o_len is None
+    input_offsets - int array (n + 1,); the inputs of node i are
+        input_indices[input_offsets[i]:input_offsets[i + 1]], pos_args first
+    input_indices - int array (m,) of node indices
+    input_keys - int array (m,), -1 for positional inputs, otherwise the
+        index of the named-arg key in `keys`
+    keys - list of named-arg keys
+    literals - dict from node index to the value of that Literal
+    root - index of the root node
+    """
+
+    def __init__(self, names, opcode, o_len, input_offsets, input_indices,
+            input_keys, keys, literals, root):
+        self.names = names
+        self.opcode = opcode
+        self.o_len = o_len
+        self.input_offsets = input_offsets
+        self.input_indices = input_indices
+        self.input_keys = input_keys
+        self.keys = keys
+        self.literals = literals
+        self.root = root
+
+    def __len__(self):
+        return len(self.opcode)
+
+    @classmethod
+    def from_apply(cls, expr):
+        """Build the arrays of the graph rooted at expr (in dfs order)
+        """
+        expr = as_apply(expr)
+        # -- iterative post-order walk, so that deep graphs are fine
+        index = {}
+        order = []
+        todo = [expr]
+        while todo:
+            node = todo[-1]
+            if node in index:
+                todo.pop()
+                continue
+            waiting_on = [ii for ii in node.inputs() if ii not in index]
+            if waiting_on:
+                todo.extend(reversed(waiting_on))
+            else:
+                todo.pop()
+                index[node] = len(order)
+                order.append(node)
+
+        names = []
+        name_idx = {}
+        keys = []
+        key_idx = {}
+        opcode = []
+        o_len = []
+        counts = []
+        input_indices = []
+        input_keys = []
+        literals = {}
+        for ii, node in enumerate(order):
+            if node.name not in name_idx:
+                name_idx[node.name] = len(names)
+                names.append(node.name)
+            opcode.append(name_idx[node.name])
+            o_len.append(-1 if node.o_len is None else node.o_len)
+            if isinstance(node, Literal):
+                literals[ii] = node._obj
+            for arg in node.pos_args:
+                input_indices.append(index[arg])
+                input_keys.append(-1)
+            for kw, arg in node.named_args:
+                if kw not in key_idx:
+                    key_idx[kw] = len(keys)
+                    keys.append(kw)
+                input_indices.append(index[arg])
+                input_keys.append(key_idx[kw])
+            counts.append(len(node.pos_args) + len(node.named_args))
+        input_offsets = np.zeros(len(order) + 1, dtype='intp')
+        np.cumsum(counts, out=input_offsets[1:])
+        return cls(names=names,
+                opcode=np.asarray(opcode, dtype='intp'),
+                o_len=np.asarray(o_len, dtype='intp'),
+                input_offsets=input_offsets,
+                input_indices=np.asarray(input_indices, dtype='intp'),
+                input_keys=np.asarray(input_keys, dtype='intp'),
+                keys=keys,
+                literals=literals,
+                root=index[expr])
+
+    def to_apply(self):
+        """Return a new Apply graph equivalent to these arrays (its root)
+        """
+        nodes = [None] * len(self)
+        for ii in self.toposort():
+            lo, hi = self.input_offsets[ii], self.input_offsets[ii + 1]
+            if ii in self.literals:
+                nodes[ii] = Literal(self.literals[ii])
+                continue
+            pos_args = []
+            named_args = []
+            for jj, kk in zip(self.input_indices[lo:hi],
+                    self.input_keys[lo:hi]):
+                if kk < 0:
+                    pos_args.append(nodes[jj])
+                else:
+                    named_args.append([self.keys[kk], nodes[jj]])
+            o_len = self.o_len[ii]
+            nodes[ii] = Apply(self.names[self.opcode[ii]], pos_args,
+                    named_args, None if o_len < 0 else int(o_len))
+        return nodes[self.root]
+
+    def edge_consumers(self):
+        """Int array (m,): the consumer node of each input edge
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.input_offsets))
+
+    def consumer_counts(self):
+        """Int array (n,): number of distinct nodes using each node as input
+        """
+        n = len(self)
+        pairs = np.unique(self.edge_consumers() * n + self.input_indices)
+        return np.bincount(pairs % n, minlength=n)
+
+    def depth(self):
+        """Int array (n,): 0 for nodes without inputs, otherwise one more
+        than the deepest input. Raises ValueError if the graph has a cycle.
+        """
+        n = len(self)
+        edge_consumers = self.edge_consumers()
+        remaining = np.diff(self.input_offsets)
+        # -- consumers of each node, in CSR form
+        order = np.argsort(self.input_indices, kind='mergesort')
+        consumers = edge_consumers[order]
+        cons_offsets = np.zeros(n + 1, dtype='intp')
+        np.cumsum(np.bincount(self.input_indices, minlength=n),
+                out=cons_offsets[1:])
+        depth = np.zeros(n, dtype='intp')
+        frontier = np.where(remaining == 0)[0]
+        level = 0
+        n_done = 0
+        while frontier.size:
+            depth[frontier] = level
+            n_done += frontier.size
+            users = consumers[_ranges(cons_offsets[frontier],
+                cons_offsets[frontier + 1])]
+            np.subtract.at(remaining, users, 1)
+            frontier = np.unique(users[remaining[users] == 0])
+            level += 1
+        if n_done != n:
+            raise ValueError('graph has a cycle')
+        return depth
+
+    def toposort(self):
+        """Int array (n,): node indices, each after all of its inputs
+        """
+        return np.argsort(self.depth(), kind='mergesort')
+
+    def reachable(self, roots=None):
+        """Bool array (n,): nodes that roots (default: the root) depend on,
+        including the roots themselves
+        """
+        if roots is None:
+            roots = [self.root]
+        mask = np.zeros(len(self), dtype=bool)
+        frontier = np.unique(np.asarray(roots, dtype='intp'))
+        while frontier.size:
+            mask[frontier] = True
+            inputs = self.input_indices[_ranges(self.input_offsets[frontier],
+                self.input_offsets[frontier + 1])]
+            frontier = np.unique(inputs[~mask[inputs]])
+        return mask
+
+    def depends_on(self, mask):
+        """Bool array (n,): nodes in mask or with a node of mask among their
+        (transitive) inputs
+        """
+        rval = np.array(mask, dtype=bool)
+        depth = self.depth()
+        edge_consumers = self.edge_consumers()
+        # -- process the edges level by level of their consumer
+        order = np.argsort(depth[edge_consumers], kind='mergesort')
+        edge_levels = depth[edge_consumers][order]
+        bounds = np.searchsorted(edge_levels, np.arange(depth.max() + 2))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            edges = order[lo:hi]
+            hit = edge_consumers[edges][rval[self.input_indices[edges]]]
+            rval[hit] = True
+        return rval
+
+    def stochastic(self):
+        """Bool array (n,): nodes of the stochastic symbols
+        """
+        is_stochastic = np.asarray([name in implicit_stochastic_symbols
+            for name in self.names], dtype=bool)
+        return is_stochastic[self.opcode]
+
+    def stochastic_dependents(self):
+        """Bool array (n,): nodes whose value depends on a stochastic node
+        """
+        return self.depends_on(self.stochastic())
@@ -2,9 +2,19 @@
 Constructs for annotating base graphs.
 """
 import sys
+import math
+import inspect
+import hashlib
+import struct
 import numpy as np
+try:
+    from scipy.special import erf
+except ImportError:
+    erf = np.vectorize(math.erf)
 
 from .base import scope, as_apply, dfs, Apply, rec_eval, clone
+from .base import inputs_changed, _update_hash
+from .base import Literal, apply_rows
 
 ################################################################################
 ################################################################################
@@ -25,6 +35,24 @@ def rng_from_seed(seed):
     return np.random.RandomState(seed)
 
 
+def _uint32_words(n):
+    n = int(n)
+    if n < 0:
+        raise ValueError('counter rng words must be non-negative', n)
+    return [n & 0xffffffff, n >> 32]
+
+
+@scope.define
+def rng_from_counter(seed, key, index):
+    """Return the RandomState of stream `key` at sample `index`
+
+    The state depends on (seed, key, index) alone, so any sample index can
+    be drawn directly, in any order, without drawing the ones before it.
+    """
+    words = _uint32_words(seed) + _uint32_words(key) + _uint32_words(index)
+    return np.random.RandomState(words)
+
+
 # -- UNIFORM
 
 @implicit_stochastic
@@ -98,6 +126,9 @@ def randint(upper, rng=None, size=()):
         elif len(size) == 1:
             assert len(upper) == size[0]
             return np.asarray([rng.randint(uu) for uu in upper])
+    if isinstance(upper, np.ndarray) and upper.ndim:
+        # -- array of upper bounds, broadcast against size
+        return np.floor(rng.uniform(size=size) * upper).astype('int')
     return rng.randint(upper, size=size)
 
 
@@ -146,9 +177,16 @@ def recursive_set_rng_kwarg(expr, rng):
     uniform(0, 1) -> uniform(0, 1, rng=rng)
     """
     lrng = as_apply(rng)
-    for node in dfs(expr):
-        if node.name in implicit_stochastic_symbols:
-            node.named_args.append(('rng', lrng))
+    # -- use the GraphIndex of expr if there is one, without building one
+    index = getattr(expr, '_graph_index', None)
+    if index is not None:
+        nodes = index.by_name(implicit_stochastic_symbols)
+    else:
+        nodes = [node for node in dfs(expr)
+                if node.name in implicit_stochastic_symbols]
+    for node in nodes:
+        node.named_args.append(('rng', lrng))
+        inputs_changed(node)
     return expr
 
 
@@ -156,3 +194,664 @@ def sample(expr, rng):
     foo = recursive_set_rng_kwarg(clone(as_apply(expr)), as_apply(rng))
     return rec_eval(foo)
 
+
+def recursive_set_counter_rng_kwarg(expr, seed, index):
+    """
+    Give each stochastic node of expr its own counter-based rng stream
+
+    The k'th stochastic node in dfs order gets
+    rng=rng_from_counter(seed, k, index), so its draws do not depend on the
+    other nodes or on the order of evaluation.
+    """
+    seed = as_apply(seed)
+    index = as_apply(index)
+    stochastic_nodes = [node for node in dfs(expr)
+            if node.name in implicit_stochastic_symbols]
+    for key, node in enumerate(stochastic_nodes):
+        node.named_args.append(('rng',
+            scope.rng_from_counter(seed, key, index)))
+        inputs_changed(node)
+    return expr
+
+
+def sample_at(expr, seed, index):
+    """Return sample number `index` of the counter-based stream `seed`
+    """
+    foo = recursive_set_counter_rng_kwarg(clone(as_apply(expr)), seed, index)
+    return rec_eval(foo)
+
+
+
+################################################################################
+################################################################################
+# -- BATCHED SAMPLING
+#
+# In a ragged batch of n samples every node holds an (idxs, vals) pair: the
+# sorted indices of the rows in which the node is evaluated, and its values
+# in those rows (an array with leading dimension len(idxs), or a list).
+# Nodes that do not depend on any stochastic node hold (None, value).
+
+def _gather(entry, rows):
+    """Return the values of a ragged entry in the given rows
+    """
+    idxs, vals = entry
+    if idxs is None:
+        return [vals] * len(rows)
+    pos = np.searchsorted(idxs, rows)
+    if isinstance(vals, np.ndarray):
+        return vals[pos]
+    return [vals[p] for p in pos]
+
+
+def _scatter(parts, positions, n_rows):
+    """Assemble values of n_rows rows from parts[i] at positions[i]
+
+    The result is an array if the non-empty parts are arrays of one dtype
+    and row shape, else a list.
+    """
+    kept = [(part, pos) for part, pos in zip(parts, positions) if len(pos)]
+    if kept:
+        parts, positions = zip(*kept)
+    arrays = [part for part in parts if isinstance(part, np.ndarray)]
+    if (kept and len(arrays) == len(parts)
+            and len(set((a.dtype, a.shape[1:]) for a in arrays)) == 1):
+        vals = np.concatenate(parts)
+        rval = np.empty_like(vals)
+        rval[np.concatenate(positions)] = vals
+        return rval
+    rval = [None] * n_rows
+    for part, pos in zip(parts, positions):
+        for val, p in zip(part, pos):
+            rval[p] = val
+    return rval
+
+
+def _split_constants(nodes):
+    """
+    Return (memo, varying) for nodes in dfs order: varying is the set of
+    nodes that depend on stochastic nodes, memo maps every other node to
+    (None, value), evaluated once.
+    """
+    memo = {}
+    varying = set()
+    for node in nodes:
+        if (node.name in implicit_stochastic_symbols
+                or any(ii in varying for ii in node.inputs())):
+            varying.add(node)
+        elif isinstance(node, Literal):
+            memo[node] = (None, node._obj)
+        else:
+            args = [memo[a][1] for a in node.pos_args]
+            kwargs = dict([(k, memo[a][1]) for k, a in node.named_args])
+            memo[node] = (None, scope._impls[node.name](*args, **kwargs))
+    return memo, varying
+
+
+def _row_inputs(node, memo, varying, idxs):
+    """
+    Return (args, kwargs, batched): the inputs of node in rows idxs, and the
+    positions and keys of those holding one value per row.
+    """
+    args = [_gather(memo[a], idxs) if a in varying else memo[a][1]
+            for a in node.pos_args]
+    kwargs = dict([(k, _gather(memo[a], idxs) if a in varying
+        else memo[a][1]) for k, a in node.named_args])
+    batched = set(ii for ii, a in enumerate(node.pos_args) if a in varying)
+    batched.update(k for k, a in node.named_args if a in varying)
+    return args, kwargs, batched
+
+
+def _rows_first(args, kwargs, batched, size):
+    """Reshape the per-row parameters of a stochastic node (see _row_inputs)
+    to broadcast against its size dims
+    """
+    ndim = 1 if isinstance(size, (int, np.integer)) else len(size)
+
+    def reshape(val):
+        arr = np.asarray(val)
+        return arr.reshape(arr.shape[:1] + (1,) * ndim + arr.shape[1:])
+    args = [reshape(a) if ii in batched else a for ii, a in enumerate(args)]
+    kwargs = dict([(k, reshape(v) if k in batched else v)
+        for k, v in kwargs.items()])
+    return args, kwargs
+
+
+def _one_of_rows(node, memo, idxs, choice):
+    """Return the values of one_of node in rows idxs, which select the
+    branches `choice`
+    """
+    parts = []
+    positions = []
+    for ii, arg in enumerate(node.pos_args):
+        pos = np.where(choice == ii)[0]
+        if len(pos):
+            parts.append(_gather(memo[arg], idxs[pos]))
+            positions.append(pos)
+    return _scatter(parts, positions, len(idxs))
+
+
+def iid_draw(node, args, kwargs, n):
+    """Draw n independent values of a stochastic node
+
+    args and kwargs hold the node's parameters, with row-dependent ones as
+    arrays of length n. For one_of nodes the draw is the selected branch
+    index and args is empty.
+    """
+    kwargs = dict(kwargs)
+    rng = kwargs.pop('rng')
+    if node.name == 'one_of':
+        return rng.randint(len(node.pos_args), size=n)
+    size = kwargs.pop('size', ())
+    if isinstance(size, (int, np.integer)):
+        size = (size,)
+    size = (n,) + tuple(size)
+    return scope._impls[node.name](*args, rng=rng, size=size, **kwargs)
+
+
+def ragged_eval(expr, n, draw=iid_draw):
+    """
+    Evaluate n samples of expr as a ragged batch.
+
+    The rows that select a given one_of branch are routed into that branch
+    alone, so the cost of each subgraph scales with the number of rows that
+    reach it. Stochastic nodes draw all of their rows with one call of
+    `draw` (see `iid_draw`), and symbols in `elementwise_symbols` are applied
+    to whole arrays of rows; other symbols are called row by row.
+
+    expr must already have rng arguments set (see recursive_set_rng_kwarg).
+
+    Returns (memo, choices): memo maps every node to its (idxs, vals) pair
+    and choices maps every one_of node to its drawn branch indices, aligned
+    with its idxs.
+    """
+    expr = as_apply(expr)
+    nodes = dfs(expr)
+    memo, varying = _split_constants(nodes)
+
+    # -- top-down: which rows reach each node, drawing one_of branches
+    active = {expr: np.arange(n)}
+    choices = {}
+    empty = np.arange(0)
+    for node in reversed(nodes):
+        idxs = active.get(node, empty)
+        if node.name == 'one_of':
+            kwargs = dict([(k, memo[a][1]) for k, a in node.named_args])
+            choice = np.asarray(draw(node, [], kwargs, len(idxs)))
+            choices[node] = choice
+            for ii, arg in enumerate(node.pos_args):
+                rows = idxs[choice == ii]
+                active[arg] = np.union1d(active.get(arg, empty), rows)
+            for name, arg in node.named_args:
+                active[arg] = np.union1d(active.get(arg, empty), idxs)
+        else:
+            for arg in node.inputs():
+                active[arg] = np.union1d(active.get(arg, empty), idxs)
+
+    # -- bottom-up: values of the row-dependent nodes
+    for node in nodes:
+        if node not in varying:
+            continue
+        idxs = active[node]
+        if node.name == 'one_of':
+            memo[node] = (idxs, _one_of_rows(node, memo, idxs, choices[node]))
+            continue
+        args, kwargs, batched = _row_inputs(node, memo, varying, idxs)
+        if node.name in implicit_stochastic_symbols:
+            args, kwargs = _rows_first(args, kwargs, batched,
+                    kwargs.get('size', ()))
+            vals = draw(node, args, kwargs, len(idxs))
+        else:
+            vals = apply_rows(node, args, kwargs, batched, len(idxs))
+        memo[node] = (idxs, vals)
+    return memo, choices
+
+
+def sample_batch(expr, rng, n):
+    """Return a list of n samples of expr, drawn as a ragged batch
+    """
+    foo = recursive_set_rng_kwarg(clone(as_apply(expr)), as_apply(rng))
+    memo, choices = ragged_eval(foo, n)
+    idxs, vals = memo[foo]
+    if idxs is None:
+        return [vals] * n
+    return list(vals)
+
+
+################################################################################
+################################################################################
+# -- STRATIFIED SAMPLING
+
+def lhs_uniforms(rng, n, size=()):
+    """Latin-hypercube uniforms of shape (n,) + size
+
+    Along the first axis every column holds one value from each of the n
+    strata [i / n, (i + 1) / n), in random order, independently of the
+    other columns.
+    """
+    shape = (n,) + tuple(size)
+    strata = np.argsort(rng.uniform(size=shape), axis=0)
+    return (strata + rng.uniform(size=shape)) / float(max(n, 1))
+
+
+def normal_ppf(u):
+    """Inverse of the standard normal cdf (Acklam's rational approximation)
+    """
+    a = [-3.969683028665376e+01, 2.209460984245205e+02,
+         -2.759285104469687e+02, 1.383577518672690e+02,
+         -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02,
+         -1.556989798598866e+02, 6.680131188771972e+01,
+         -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01,
+         -2.400758277161838e+00, -2.549732539343734e+00,
+         4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01,
+         2.445134137142996e+00, 3.754408661907416e+00]
+    u = np.clip(np.asarray(u, dtype='float64'), 1e-300, 1 - 1e-16)
+    tail = np.minimum(u, 1 - u)
+    # -- tails
+    t = np.sqrt(-2 * np.log(tail))
+    x_tail = ((((((c[0] * t + c[1]) * t + c[2]) * t + c[3]) * t + c[4]) * t
+        + c[5]) / ((((d[0] * t + d[1]) * t + d[2]) * t + d[3]) * t + 1))
+    x_tail = np.where(u < 0.5, x_tail, -x_tail)
+    # -- center
+    r = (u - 0.5) ** 2
+    x_mid = ((((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r
+        + a[5]) * (u - 0.5) / (((((b[0] * r + b[1]) * r + b[2]) * r + b[3])
+            * r + b[4]) * r + 1))
+    return np.where(tail < 0.02425, x_tail, x_mid)
+
+
+def _quantize(x, q):
+    return np.ceil(x / q) * q
+
+
+# -- inverse cdfs: (u, **params) -> values
+stratified_ppfs = {
+    'uniform': lambda u, low, high: low + u * (high - low),
+    'loguniform': lambda u, low, high: np.exp(low + u * (high - low)),
+    'quniform': lambda u, low, high, q: _quantize(low + u * (high - low), q),
+    'qloguniform': lambda u, low, high, q: _quantize(
+        np.exp(low + u * (high - low)), q),
+    'normal': lambda u, mu, sigma: mu + sigma * normal_ppf(u),
+    'qnormal': lambda u, mu, sigma, q: _quantize(
+        mu + sigma * normal_ppf(u), q),
+    'lognormal': lambda u, mu, sigma: np.exp(mu + sigma * normal_ppf(u)),
+    'qlognormal': lambda u, mu, sigma, q: _quantize(
+        np.exp(mu + sigma * normal_ppf(u)), q),
+    'randint': lambda u, upper: np.floor(u * upper).astype('int'),
+    }
+
+
+def stratified_draw(node, args, kwargs, n):
+    """Draw n Latin-hypercube values of a stochastic node
+
+    A drop-in `draw` for ragged_eval: the n rows that reach the node get one
+    value from each of n equal-probability strata of its distribution (per
+    element, with a size). one_of nodes spread their rows evenly over the
+    branches, so every branch is itself stratified over the rows it gets.
+    Symbols without an inverse cdf fall back to iid_draw.
+    """
+    rng = kwargs['rng']
+    if node.name == 'one_of':
+        u = lhs_uniforms(rng, n)
+        return np.floor(u * len(node.pos_args)).astype('int')
+    if node.name == 'categorical':
+        params = inspect.getcallargs(scope._impls[node.name], *args, **kwargs)
+        p = np.asarray(params['p'], dtype='float64')
+        if p.ndim == 1:
+            size = params['size']
+            if isinstance(size, (int, np.integer)):
+                size = (size,)
+            u = lhs_uniforms(rng, n, size)
+            cdf = np.cumsum(p) / p.sum()
+            return np.minimum(np.searchsorted(cdf, u, side='right'),
+                    len(p) - 1)
+    elif node.name in stratified_ppfs:
+        params = inspect.getcallargs(scope._impls[node.name], *args, **kwargs)
+        params.pop('rng')
+        size = params.pop('size')
+        if isinstance(size, (int, np.integer)):
+            size = (size,)
+        u = lhs_uniforms(rng, n, size)
+        return stratified_ppfs[node.name](u, **params)
+    return iid_draw(node, args, kwargs, n)
+
+
+def sample_lhs(expr, rng, n):
+    """Return a list of n samples of expr, drawn as a Latin hypercube
+
+    See stratified_draw.
+    """
+    foo = recursive_set_rng_kwarg(clone(as_apply(expr)), as_apply(rng))
+    memo, choices = ragged_eval(foo, n, draw=stratified_draw)
+    idxs, vals = memo[foo]
+    if idxs is None:
+        return [vals] * n
+    return list(vals)
+
+
+################################################################################
+################################################################################
+# -- DEDUPLICATION
+
+def sample_key(value):
+    """Return a 64-bit integer key of a sample, equal for equal samples
+    """
+    h = hashlib.sha1()
+    _update_hash(h, value)
+    return struct.unpack('<q', h.digest()[:8])[0]
+
+
+class KeySet(object):
+    """Exact index of sample keys, backed by a Python set
+    """
+    def __init__(self):
+        self._keys = set()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def contains(self, keys):
+        return np.asarray([int(k) in self._keys for k in keys], dtype=bool)
+
+    def add(self, keys):
+        self._keys.update(int(k) for k in keys)
+
+
+class BloomFilter(object):
+    """Approximate index of sample keys in a fixed-size NumPy bit array
+
+    Lookups and insertions are vectorized over arrays of keys. contains()
+    has no false negatives, and false positives at a rate of about
+    `error_rate` once `capacity` keys have been added.
+    """
+    def __init__(self, capacity=1000000, error_rate=1e-3):
+        n_bits = int(np.ceil(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.n_bits = max(n_bits, 8)
+        self.n_hashes = max(int(round(self.n_bits * np.log(2) / capacity)), 1)
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype='uint8')
+        self.n_added = 0
+
+    def __len__(self):
+        return self.n_added
+
+    def _positions(self, keys):
+        # -- double hashing: position i is h1 + i * h2 (mod n_bits)
+        keys = np.asarray(keys, dtype='int64').view('uint64')
+        h1 = keys & np.uint64(0xffffffff)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        ii = np.arange(self.n_hashes, dtype='uint64')
+        return (h1[:, None] + ii * h2[:, None]) % np.uint64(self.n_bits)
+
+    def contains(self, keys):
+        pos = self._positions(keys)
+        bits = self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype('uint8')
+        return np.all(bits & 1, axis=1)
+
+    def add(self, keys):
+        pos = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, (pos >> np.uint64(3)).astype('intp'),
+                (1 << (pos & np.uint64(7))).astype('uint8'))
+        self.n_added += len(keys)
+
+
+class DedupSampler(object):
+    """
+    Draw samples of expr that differ from every sample drawn before.
+
+    Each sample is reduced to a 64-bit key (see `sample_key`) that is looked
+    up in `index`, a KeySet by default or e.g. a BloomFilter for very many
+    samples. The key covers the sample itself rather than the raw draws,
+    because rec_eval draws from every one_of branch, including the ones that
+    were not selected.
+    """
+    def __init__(self, expr, rng, index=None, max_redraws=100):
+        self.expr = recursive_set_rng_kwarg(clone(as_apply(expr)),
+                as_apply(rng))
+        if index is None:
+            index = KeySet()
+        self.index = index
+        self.max_redraws = max_redraws
+
+    def sample(self):
+        """Return a new sample, redrawing up to max_redraws duplicates
+        """
+        for ii in xrange(self.max_redraws + 1):
+            rval = rec_eval(self.expr)
+            keys = [sample_key(rval)]
+            if not self.index.contains(keys)[0]:
+                self.index.add(keys)
+                return rval
+        raise RuntimeError('No new sample in %i draws' % (ii + 1))
+
+    def sample_batch(self, n):
+        """Draw n samples and return those that are new, skipping duplicates
+        """
+        vals = [rec_eval(self.expr) for ii in xrange(n)]
+        keys = np.asarray([sample_key(val) for val in vals], dtype='int64')
+        if n == 0:
+            return []
+        # -- keep the first occurrence of each key that is not in the index
+        _, first = np.unique(keys, return_index=True)
+        keep = np.zeros(n, dtype=bool)
+        keep[first] = True
+        keep &= ~self.index.contains(keys)
+        self.index.add(keys[keep])
+        return [val for val, kk in zip(vals, keep) if kk]
+
+
+################################################################################
+################################################################################
+# -- LOG DENSITIES
+
+log_density_impls = {}
+
+
+def log_density(name):
+    """Decorator registering f as the log-density of stochastic symbol `name`
+
+    f is called as f(x, *args, **kwargs) where x is an array of observed
+    values and args, kwargs are the (possibly broadcast) parameters of the
+    node, without the rng and size arguments.
+    """
+    def wrapper(f):
+        log_density_impls[name] = f
+        return f
+    return wrapper
+
+
+def _normal_cdf(x, mu, sigma):
+    return 0.5 * (1 + erf((x - mu) / (sigma * np.sqrt(2))))
+
+
+def _on_grid(x, q):
+    ratio = x / q
+    return np.abs(ratio - np.round(ratio)) < 1e-6 * np.maximum(1, np.abs(ratio))
+
+
+def _log_mass(mass, x, q):
+    """log of a quantized probability mass, -inf off the grid of q"""
+    return np.where(_on_grid(x, q) & (mass > 0), np.log(mass), -np.inf)
+
+
+@log_density('uniform')
+def uniform_lpdf(x, low, high):
+    inside = (low <= x) & (x <= high)
+    return np.where(inside, -np.log(high - low), -np.inf)
+
+
+@log_density('loguniform')
+def loguniform_lpdf(x, low, high):
+    logx = np.log(x)
+    inside = (low <= logx) & (logx <= high)
+    return np.where(inside, -np.log(high - low) - logx, -np.inf)
+
+
+@log_density('quniform')
+def quniform_lpdf(x, low, high, q):
+    lower = np.maximum(x - q, low)
+    upper = np.minimum(x, high)
+    mass = np.maximum(upper - lower, 0) / (high - low)
+    return _log_mass(mass, x, q)
+
+
+@log_density('qloguniform')
+def qloguniform_lpdf(x, low, high, q):
+    lower = np.maximum(np.log(np.maximum(x - q, 0)), low)
+    upper = np.minimum(np.log(x), high)
+    mass = np.maximum(upper - lower, 0) / (high - low)
+    return _log_mass(mass, x, q)
+
+
+@log_density('normal')
+def normal_lpdf(x, mu, sigma):
+    z = (x - mu) / sigma
+    return -0.5 * z ** 2 - np.log(sigma * np.sqrt(2 * np.pi))
+
+
+@log_density('qnormal')
+def qnormal_lpdf(x, mu, sigma, q):
+    mass = _normal_cdf(x, mu, sigma) - _normal_cdf(x - q, mu, sigma)
+    return _log_mass(mass, x, q)
+
+
+@log_density('lognormal')
+def lognormal_lpdf(x, mu, sigma):
+    logx = np.log(x)
+    return np.where(x > 0, normal_lpdf(logx, mu, sigma) - logx, -np.inf)
+
+
+@log_density('qlognormal')
+def qlognormal_lpdf(x, mu, sigma, q):
+    lower = np.log(np.maximum(x - q, 0))
+    mass = (_normal_cdf(np.log(x), mu, sigma)
+            - np.where(x - q > 0, _normal_cdf(lower, mu, sigma), 0))
+    return _log_mass(mass, x, q)
+
+
+@log_density('randint')
+def randint_lpdf(x, upper):
+    valid = (0 <= x) & (x < upper) & (np.floor(x) == x)
+    return np.where(valid, -np.log(upper), -np.inf)
+
+
+@log_density('categorical')
+def categorical_lpdf(x, p):
+    logp = np.log(np.asarray(p))
+    x = np.asarray(x)
+    valid = (0 <= x) & (x < len(logp))
+    return np.where(valid, logp[np.where(valid, x, 0).astype('int')], -np.inf)
+
+
+@log_density('one_of')
+def one_of_lpdf(x, n_options):
+    x = np.asarray(x)
+    valid = (0 <= x) & (x < n_options)
+    return np.where(valid, -np.log(n_options), -np.inf)
+
+
+def log_prob(expr, samples):
+    """
+    Return the log-density of N configurations of `expr` as an array (N,)
+
+    samples - dict mapping stochastic nodes of `expr` to arrays of N observed
+        values (with the node's `size` as trailing dimensions). For one_of
+        nodes the observed value is the index of the selected branch.
+
+    The graph is walked once: a top-down pass works out which rows reach
+    each node through the selected one_of branches, and then each
+    stochastic node contributes its density, computed with NumPy over all
+    rows at once, to the rows in which it is active. Entries for inactive
+    rows are ignored, and nodes that are never active may be omitted.
+
+    Parameters of stochastic nodes may depend on other (observed) stochastic
+    nodes, one_of nodes included, in which case they are evaluated for the
+    rows in which they are active, as in ragged_eval.
+    """
+    expr = as_apply(expr)
+    nodes = dfs(expr)
+    lens = set(len(v) for v in samples.values())
+    if len(lens) != 1:
+        raise ValueError('samples must hold the same number of rows'
+                ' for every node', lens)
+    N, = lens
+
+    active = {expr: np.ones(N, dtype=bool)}
+    for node in reversed(nodes):
+        mask = active[node]
+        if node.name == 'one_of':
+            if mask.any() and node not in samples:
+                raise KeyError('no observed branch for one_of node', node)
+            choice = np.asarray(samples.get(node, np.zeros(N)))
+            for ii, arg in enumerate(node.pos_args):
+                active[arg] = active.get(arg, False) | (mask & (choice == ii))
+            for name, arg in node.named_args:
+                active[arg] = active.get(arg, False) | mask
+        else:
+            for arg in node.inputs():
+                active[arg] = active.get(arg, False) | mask
+
+    observed = dict((node, np.asarray(val)) for node, val in samples.items())
+
+    def observed_rows(node, idxs):
+        if node not in observed:
+            raise KeyError('no observed values for stochastic node', node)
+        return observed[node][idxs]
+
+    memo, varying = _split_constants(nodes)
+
+    # -- the row-dependent nodes that parameters of active stochastic nodes
+    #    need, through the selected branches of one_of nodes only
+    needed = set()
+    for node in reversed(nodes):
+        if node.name == 'one_of':
+            if node in needed:
+                choice = observed_rows(node, active[node])
+                needed.update(arg for ii, arg in enumerate(node.pos_args)
+                        if arg in varying and (choice == ii).any())
+        elif node.name in implicit_stochastic_symbols:
+            if active[node].any():
+                needed.update(a for a in node.inputs() if a in varying)
+        elif node in needed:
+            needed.update(a for a in node.inputs() if a in varying)
+
+    # -- their values in the rows where they are active, as in ragged_eval
+    for node in nodes:
+        if node not in needed:
+            continue
+        idxs = np.where(active[node])[0]
+        if node.name == 'one_of':
+            memo[node] = (idxs, _one_of_rows(node, memo, idxs,
+                observed_rows(node, idxs)))
+        elif node.name in implicit_stochastic_symbols:
+            memo[node] = (idxs, observed_rows(node, idxs))
+        else:
+            args, kwargs, batched = _row_inputs(node, memo, varying, idxs)
+            memo[node] = (idxs, apply_rows(node, args, kwargs, batched,
+                len(idxs)))
+
+    rval = np.zeros(N)
+    for node in nodes:
+        if node.name not in implicit_stochastic_symbols:
+            continue
+        idxs = np.where(active[node])[0]
+        if not len(idxs):
+            continue
+        x = observed_rows(node, idxs)
+        if node.name == 'one_of':
+            # -- the branches themselves are scored by their own nodes
+            args = [len(node.pos_args)]
+            kwargs = {}
+        else:
+            args, kwargs, batched = _row_inputs(node, memo, varying, idxs)
+            size = kwargs.pop('size', ())
+            kwargs.pop('rng', None)
+            args, kwargs = _rows_first(args, kwargs, batched, size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lp = log_density_impls[node.name](x, *args, **kwargs)
+        lp = np.asarray(lp)
+        if lp.ndim == 0:
+            lp = lp + np.zeros(len(idxs))
+        rval[idxs] += lp.reshape((len(idxs), -1)).sum(axis=1)
+    return rval
@@ -0,0 +1,201 @@
+"""
+Run one graph as a per-record transformation over a stream of records.
+
+    >>> x = scope.placeholder('x')
+    >>> pipe = Pipeline(scope.log(x + 1), inputs=['x'], batch_size=256)
+    >>> for y in pipe.run(iter_records()):
+    ...     print y
+
+The graph is analysed once: nodes that do not depend on the inputs are
+evaluated once and reused for every record, and the nodes that do are
+compiled into a flat schedule that is replayed per record (or per
+micro-batch of records) without any graph traversal.
+"""
+import sys
+import threading
+import Queue
+
+import numpy as np
+
+from .base import as_apply, dfs, scope, Literal, elementwise_symbols
+from .base import placeholder_name, broadcast_rows
+
+
+class Pipeline(object):
+    """
+    expr - the graph to evaluate for every record
+
+    inputs - nodes of expr whose values come from the records, or names of
+        placeholders of expr (see scope.placeholder). A record is a sequence
+        of values aligned with inputs, or a dict keyed by the inputs.
+
+    batch_size - number of records evaluated together. When every node that
+        depends on the inputs is elementwise, a micro-batch is evaluated
+        with one NumPy call per node; otherwise records are evaluated one by
+        one, batch_size only sets how many are read at a time.
+
+    buffer_size - if given, records are read ahead by a background thread
+        into a queue of at most this many records. The reader blocks when
+        the queue is full, so a slow consumer holds back the producer.
+    """
+
+    def __init__(self, expr, inputs, batch_size=1, buffer_size=None):
+        self.expr = as_apply(expr)
+        nodes = dfs(self.expr)
+        placeholders = dict((placeholder_name(node), node) for node in nodes
+            if node.name == 'placeholder')
+        self.input_keys = list(inputs)
+        self.inputs = [placeholders[ii] if isinstance(ii, basestring) else ii
+                for ii in inputs]
+        if len(set(self.inputs)) != len(self.inputs):
+            raise ValueError('duplicate inputs', self.input_keys)
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+
+        slots = dict((node, ii) for ii, node in enumerate(self.inputs))
+        self.constants = {}
+        self.schedule = []
+        for node in nodes:
+            if node in slots:
+                continue
+            if not any(ii in slots for ii in node.inputs()):
+                self.constants[node] = self._eval_constant(node)
+                continue
+            slots[node] = len(slots)
+            self.schedule.append((
+                node.name,
+                scope._impls[node.name],
+                [self._operand(a, slots) for a in node.pos_args],
+                [(k, self._operand(a, slots)) for k, a in node.named_args]))
+        self.n_slots = len(slots)
+        self.output = self._operand(self.expr, slots)
+        # -- an empty schedule gains nothing from batching, and NumPy
+        #    would convert the records on the way through
+        self.batchable = bool(self.schedule) and all(
+                name in elementwise_symbols
+                for name, f, args, kwargs in self.schedule)
+
+    def _eval_constant(self, node):
+        if isinstance(node, Literal):
+            return node._obj
+        args = [self.constants[a] for a in node.pos_args]
+        kwargs = dict([(k, self.constants[a]) for k, a in node.named_args])
+        return scope._impls[node.name](*args, **kwargs)
+
+    def _operand(self, node, slots):
+        # -- (True, slot) for values computed per record, else (False, value)
+        if node in slots:
+            return (True, slots[node])
+        return (False, self.constants[node])
+
+    def _record_values(self, record):
+        if isinstance(record, dict):
+            return [record[key] for key in self.input_keys]
+        if len(record) != len(self.inputs):
+            raise ValueError('record does not match inputs', record)
+        return list(record)
+
+    def _run_schedule(self, values, batched=False):
+        # -- with batched, values hold one row per record and every step is
+        #    an elementwise whole-array call (see broadcast_rows)
+        values = values + [None] * (self.n_slots - len(values))
+        ii = len(self.inputs)
+        for name, f, args, kwargs in self.schedule:
+            a = [values[v] if is_slot else v for is_slot, v in args]
+            kw = [values[v] if is_slot else v for k, (is_slot, v) in kwargs]
+            if batched:
+                operands = broadcast_rows(a + kw,
+                    [is_slot for is_slot, v in args + [o for k, o in kwargs]])
+                a, kw = operands[:len(a)], operands[len(a):]
+            values[ii] = f(*a, **dict(zip([k for k, o in kwargs], kw)))
+            ii += 1
+        is_slot, v = self.output
+        return values[v] if is_slot else v
+
+    def eval(self, record):
+        """Return the output of the graph for one record
+        """
+        return self._run_schedule(self._record_values(record))
+
+    def eval_batch(self, records):
+        """Return the list of outputs for a list of records
+        """
+        rows = [self._record_values(record) for record in records]
+        if not rows:
+            return []
+        if self.batchable and len(rows) > 1:
+            columns = [np.asarray(col) for col in zip(*rows)]
+            out = self._run_schedule(columns, batched=True)
+            if self.output[0]:
+                # -- scalars as Python objects, rows of arrays as arrays
+                return out.tolist() if out.ndim == 1 else list(out)
+            return [out] * len(rows)
+        return [self._run_schedule(row) for row in rows]
+
+    def run(self, records):
+        """Yield the output for each record of the iterable `records`
+        """
+        if self.buffer_size is not None:
+            records = _prefetch(records, self.buffer_size)
+        try:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    for out in self.eval_batch(batch):
+                        yield out
+                    batch = []
+            for out in self.eval_batch(batch):
+                yield out
+        finally:
+            # -- stop the reader thread if the caller stops early
+            if self.buffer_size is not None:
+                records.close()
+
+
+_end_of_stream = object()
+
+
+def _prefetch(iterable, buffer_size):
+    """Yield the items of iterable, read ahead by a thread into a queue of
+    at most buffer_size items
+
+    Closing the generator early stops the thread.
+    """
+    queue = Queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(entry):
+        # -- returns False if the consumer is gone
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.05)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((_end_of_stream, sys.exc_info()))
+        else:
+            put((_end_of_stream, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if item is _end_of_stream:
+                break
+            yield item
+    finally:
+        stop.set()
+    thread.join()
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
@@ -0,0 +1,207 @@
+"""
+Streaming summaries of the prior distribution of a search space.
+
+    >>> report = summarize(space, np.random.RandomState(0), 10 ** 6)
+    >>> print report
+
+Samples are drawn in chunks with stochastic.ragged_eval, and for every
+stochastic node one-pass accumulators are updated with the chunk: moments
+(Welford / Chan), a merging t-digest for quantiles, value counts for the
+discrete symbols and branch counts for one_of. Memory does not grow with
+the number of samples.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from .base import as_apply, clone, dfs
+from .stochastic import implicit_stochastic_symbols, ragged_eval
+from .stochastic import recursive_set_rng_kwarg
+
+# -- symbols whose draws are integer codes worth counting
+discrete_symbols = set(['randint', 'categorical'])
+
+
+class Moments(object):
+    """Count, mean and variance, updated with batches of values
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64').ravel()
+        n_b = len(values)
+        if not n_b:
+            return
+        mean_b = values.mean()
+        m2_b = ((values - mean_b) ** 2).sum()
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / n
+        self.n = n
+
+    @property
+    def var(self):
+        if self.n < 2:
+            return np.nan
+        return self.m2 / (self.n - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class TDigest(object):
+    """Merging t-digest: approximate quantiles in O(compression) memory
+
+    Each update sorts the current centroids together with the new values and
+    merges neighbours whose quantiles map to the same unit of the arcsine
+    scale function, so the tails are kept at a finer resolution.
+    """
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64').ravel()
+        if not len(values):
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        order = np.argsort(means, kind='mergesort')
+        means = means[order]
+        weights = weights[order]
+        cum = np.cumsum(weights)
+        q = (cum - weights / 2) / cum[-1]
+        k = self.compression / np.pi * np.arcsin(2 * q - 1)
+        group = np.floor(k - k[0]).astype('intp')
+        self.weights = np.bincount(group, weights)
+        keep = self.weights > 0
+        self.means = np.bincount(group, weights * means)[keep] \
+                / self.weights[keep]
+        self.weights = self.weights[keep]
+
+    def quantile(self, q):
+        """Approximate quantile(s) q (scalar or array, in [0, 1])
+        """
+        if not len(self.weights):
+            return np.nan * np.asarray(q)
+        cum = np.cumsum(self.weights)
+        centers = (cum - self.weights / 2) / cum[-1]
+        xp = np.concatenate([[0], centers, [1]])
+        fp = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(q, xp, fp)
+
+
+class Counts(object):
+    """Counts of non-negative integer codes, growing as needed
+    """
+    def __init__(self, minlength=0):
+        self.counts = np.zeros(minlength, dtype='int64')
+
+    def update(self, codes):
+        codes = np.asarray(codes).ravel().astype('intp')
+        counts = np.bincount(codes, minlength=len(self.counts))
+        counts[:len(self.counts)] += self.counts
+        self.counts = counts
+
+    def frequencies(self):
+        total = self.counts.sum()
+        return self.counts / float(total) if total else self.counts * 0.0
+
+
+class NodeSummary(object):
+    """Accumulated statistics of one stochastic node
+
+    n_active - number of samples in which the node was drawn
+    moments, digest - of the drawn values (all elements, with a size)
+    counts - Counts of the drawn codes (discrete symbols) or of the
+        selected branches (one_of), else None
+    """
+    def __init__(self, node, compression=200):
+        self.node = node
+        self.n_active = 0
+        self.moments = Moments()
+        self.digest = TDigest(compression)
+        if node.name == 'one_of':
+            self.counts = Counts(len(node.pos_args))
+        elif node.name in discrete_symbols:
+            self.counts = Counts()
+        else:
+            self.counts = None
+
+    def update(self, values, choices=None):
+        self.n_active += len(values)
+        if self.node.name == 'one_of':
+            self.counts.update(choices)
+            return
+        values = np.asarray(values)
+        self.moments.update(values)
+        self.digest.update(values)
+        if self.counts is not None:
+            self.counts.update(values)
+
+
+class Summary(object):
+    """Report of summarize(): n_samples and a NodeSummary per node
+    """
+    def __init__(self, nodes, n_samples):
+        self.nodes = nodes
+        self.n_samples = n_samples
+
+    def __getitem__(self, node):
+        return self.nodes[node]
+
+    def __str__(self):
+        lines = ['%i samples' % self.n_samples]
+        for ii, (node, summary) in enumerate(self.nodes.items()):
+            rate = summary.n_active / float(max(self.n_samples, 1))
+            line = '%i %s active=%.3f' % (ii, node.name, rate)
+            if node.name == 'one_of':
+                line += ' branches=%s' % np.round(
+                        summary.counts.frequencies(), 3).tolist()
+            elif summary.moments.n:
+                q05, q50, q95 = summary.digest.quantile([.05, .5, .95])
+                line += ' mean=%.4g std=%.4g q05=%.4g q50=%.4g q95=%.4g' % (
+                        summary.moments.mean, summary.moments.std,
+                        q05, q50, q95)
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+def summarize(expr, rng, n_samples, chunk_size=10000, compression=200):
+    """
+    Draw n_samples samples of expr in chunks and summarize every stochastic
+    node without storing the samples.
+
+    Returns a Summary whose NodeSummary objects are keyed by the stochastic
+    nodes of expr.
+    """
+    expr = as_apply(expr)
+    memo = {}
+    foo = recursive_set_rng_kwarg(clone(expr, memo), as_apply(rng))
+    # -- report on the nodes of expr, not on those of the clone
+    originals = dict((new, old) for old, new in memo.items())
+    nodes = [node for node in dfs(foo)
+            if node.name in implicit_stochastic_symbols]
+    summaries = dict((node, NodeSummary(originals[node], compression))
+            for node in nodes)
+    done = 0
+    while done < n_samples:
+        n = min(chunk_size, n_samples - done)
+        values, choices = ragged_eval(foo, n)
+        for node in nodes:
+            idxs, vals = values[node]
+            summaries[node].update(vals, choices.get(node))
+        done += n
+    ordered = OrderedDict((originals[node], summaries[node])
+            for node in nodes)
+    return Summary(ordered, n_samples)
@@ -192,3 +192,297 @@ def test_bincount():
     test_f(base._bincount_slow)
     test_f(base.bincount)
 
+
+
+def test_graph_index():
+    a = as_apply(1)
+    b = scope.add(a, 2)
+    c = scope.mul(b, b)
+    d = scope.add(c, a)
+    index = graph_index(d)
+    assert index is graph_index(d)
+    assert len(index) == 5
+    assert set(index.by_name('add')) == set([b, d])
+    assert set(index.by_name(['add', 'mul'])) == set([b, c, d])
+    assert set(index.consumers(a)) == set([b, d])
+    assert index.consumers(b) == [c]
+    assert index.depth(a) == 0
+    assert index.depth(b) == 1
+    assert index.depth(d) == 3
+
+
+def test_graph_index_replace_input():
+    a = as_apply(1)
+    b = scope.add(a, 2)
+    c = scope.mul(b, b)
+    d = scope.add(c, a)
+    index = graph_index(d)
+    e = scope.sub(a, 3)
+    assert d.replace_input(c, e) == [0]
+    assert c not in index
+    assert b not in index
+    assert e in index
+    assert index.by_name('mul') == []
+    assert index.by_name('sub') == [e]
+    assert set(index.consumers(a)) == set([d, e])
+    assert index.depth(d) == 2
+    assert len(index) == len(dfs(d))
+
+
+def test_graph_index_pickle():
+    import cPickle
+    a = scope.add(1, 2)
+    b = scope.mul(a, 3)
+    size = len(cPickle.dumps(b, 2))
+    index = graph_index(b)
+    assert len(cPickle.dumps(b, 2)) == size
+    # -- edits update only the indexes that contain the edited node
+    other = scope.sub(4, 5)
+    graph_index(other)
+    other.replace_input(other.pos_args[0], as_apply(6))
+    assert base._index_registry[id(a)]() is index
+    assert base._index_registry[id(other)]() is graph_index(other)
+    # -- a node can be in several indexes
+    c = scope.sub(a, 1)
+    index_c = graph_index(c)
+    refs = base._index_registry[id(a)]
+    assert set(r() for r in refs) == set([index, index_c])
+    a.replace_input(a.pos_args[0], as_apply(7))
+    seven = a.pos_args[0]
+    assert seven in index and seven in index_c
+    assert rec_eval(b) == 27 and rec_eval(c) == 8
+
+
+def test_graph_index_released():
+    import gc
+    gc.collect()
+    n_before = len(base._index_registry)
+    for ii in range(10):
+        graph_index(scope.add(ii, 2))
+    assert len(base._index_registry) > n_before
+    gc.collect()
+    assert len(base._index_registry) == n_before
+
+
+def test_fingerprint():
+    def space():
+        return as_apply({'a': scope.add(1, np.arange(3)),
+            'b': [scope.exp(2.0), 'foo']})
+    s0 = space()
+    s1 = space()
+    assert s0 is not s1
+    assert fingerprint(s0) == fingerprint(s1)
+    assert fingerprint(s0) == fingerprint(clone(s0))
+    assert fingerprint(s0) != fingerprint(s0.named_args[1][1])
+    assert fingerprint(as_apply(np.arange(3))) != fingerprint(
+            as_apply(np.arange(3.0)))
+    assert fingerprint(as_apply(1)) != fingerprint(as_apply(1.0))
+    assert fingerprint(scope.sub(1, 2)) != fingerprint(scope.sub(2, 1))
+
+
+def test_fingerprint_replace_input():
+    a = scope.add(1, 2)
+    b = scope.mul(a, 3)
+    c = scope.sub(b, 4)
+    before = fingerprint(c)
+    b_before = fingerprint(b)
+    a.replace_input(a.pos_args[0], as_apply(5))
+    assert fingerprint(c) != before
+    assert fingerprint(b) != b_before
+    a.replace_input(a.pos_args[0], as_apply(1))
+    assert fingerprint(c) == before
+    assert not hasattr(c, '_graph_index')
+    memo = {}
+    assert fingerprint(c, memo) == before
+    assert memo[b] == b_before and len(memo) == len(dfs(c))
+
+
+def test_fingerprint_copies():
+    import copy
+    import cPickle
+    a = scope.add(2, 3)
+    b = scope.mul(a, 1)
+    before = fingerprint(b)
+    for dup in [cPickle.loads(cPickle.dumps(b, 2)), copy.deepcopy(b)]:
+        assert fingerprint(dup) == before
+        dup.replace_input(dup.pos_args[1], as_apply(2))
+        assert rec_eval(dup) == 10
+        assert fingerprint(dup) != before
+        assert fingerprint(dup) == fingerprint(scope.mul(scope.add(2, 3), 2))
+    assert fingerprint(b) == before
+
+
+def test_as_apply_bulk_literal():
+    big = range(base.LITERAL_BULK_LEN)
+    al = as_apply(big)
+    assert isinstance(al, Literal)
+    assert al.obj == tuple(big)
+    assert rec_eval(al) == rec_eval(Apply('pos_args', map(as_apply, big), {}))
+    # -- lists holding Applies still become pos_args
+    al = as_apply(big + [as_apply(1)])
+    assert al.name == 'pos_args'
+    arr = np.arange(10)
+    assert as_apply(arr).obj is arr
+
+
+def test_literal_pprint_summarized():
+    assert str(Literal(np.zeros((1000, 3)))) == \
+            '0 Literal{array(shape=(1000, 3), dtype=float64)}'
+    assert str(Literal(['a'] * 1000)) == \
+            "0 Literal{['a', 'a', 'a', ... <1000 items>]}"
+    assert str(Literal(np.arange(3))) == '0 Literal{[0 1 2]}'
+    assert len(str(Literal('x' * 10000))) < 2 * base.PPRINT_MAX_CHARS
+    assert str(Literal((1, 'a', [2.5]))) == "0 Literal{(1, 'a', [2.5])}"
+    assert str(Literal((1,))) == '0 Literal{(1,)}'
+    assert str(Literal({'a': 1})) == '0 Literal{<dict of 1 items>}'
+    # -- short containers of long values are not formatted in full
+    big = Literal([range(10 ** 6), 'y' * 10 ** 6, [[[[1]]]]])
+    assert len(str(big)) < 2 * base.PPRINT_MAX_CHARS
+    assert '<1000000 items>' in str(big)
+    many = Literal([[ii] * 20 for ii in range(20)])
+    assert len(str(many)) < 2 * base.PPRINT_MAX_CHARS
+
+
+def test_pprint_shared_and_deep():
+    a = as_apply(1)
+    b = scope.add(a, a)
+    assert str(b) == '0 add\n1   Literal{1}\n2   Literal{1}  [line:1]'
+    d = as_apply({'k': b})
+    assert str(d) == ('0 dict\n1  k =\n2   add\n3     Literal{1}\n'
+            '4     Literal{1}  [line:3]')
+    c = a
+    for ii in range(5000):
+        c = scope.identity(c)
+    assert len(str(c).split('\n')) == 5001
+
+
+_test_counted_calls = []
+
+@scope.define
+def _test_counted(x):
+    _test_counted_calls.append(x)
+    return x
+
+
+def test_rec_eval_many():
+    calls = _test_counted_calls
+    del calls[:]
+    shared = scope._test_counted(3)
+    a = shared + 1
+    b = shared * 2
+    c = scope._test_counted(10)
+    d = as_apply({'a': a, 'b': b, 'c': c})
+    assert rec_eval_many([a, b]) == [4, 6]
+    assert calls == [3]
+    memo = {shared: 5}
+    assert rec_eval_many([b, a], memo=memo) == [10, 6]
+    assert c not in memo and d not in memo
+
+
+def test_prune():
+    shared = scope.add(1, 2)
+    d = as_apply({'a': shared + 1, 'b': shared * 2, 'c': scope.sqrt(4)})
+    a, b = prune(d, ['a', 'b'])
+    assert rec_eval_many([a, b]) == [4, 6]
+    assert a.pos_args[0] is b.pos_args[0]
+    assert a.pos_args[0] is not shared
+    nodes = dfs(as_apply([a, b]))
+    assert 'sqrt' not in [n.name for n in nodes]
+    c, = prune(d, [d.named_args[2][1]])
+    assert rec_eval(c) == 2
+
+
+def test_array_union():
+    u = base.array_union([3, 1, 2], np.array([2, 5]))
+    assert list(u) == [1, 2, 3, 5]
+    assert u.dtype.kind == 'i'
+    assert base.array_union([3, 1], []).dtype.kind == 'i'
+    assert list(base.array_union([], [])) == []
+
+
+def test_batched_symbols():
+    x = np.arange(6)
+    assert list(rec_eval(scope.where(x > 2, x, -x))) == [0, -1, -2, 3, 4, 5]
+    assert list(rec_eval(scope.switch(x % 3, x, 10 * x, 100 * x))) == \
+            [0, 10, 200, 3, 40, 500]
+    assert list(rec_eval(scope.clip(x, 1, 4))) == [1, 1, 2, 3, 4, 4]
+    assert list(rec_eval(scope.concatenate([x[:2], x[4:]]))) == [0, 1, 4, 5]
+    assert list(rec_eval(scope.take(x, [5, 0]))) == [5, 0]
+    assert rec_eval(scope.getitem(as_apply(x), 3)) == 3
+
+
+def test_substitute():
+    leaf = as_apply(2)
+    branch = scope.mul(leaf, 3)
+    other = scope.sqrt(16)
+    top = as_apply({'a': branch + 1, 'b': other, 'c': [other, branch]})
+    before = str(top)
+    new_top = substitute(top, {leaf: 5})
+    assert str(top) == before
+    assert rec_eval(top) == {'a': 7, 'b': 4.0, 'c': (4.0, 6)}
+    assert rec_eval(new_top) == {'a': 16, 'b': 4.0, 'c': (4.0, 15)}
+    # -- the untouched parts of the graph are shared
+    assert new_top is not top
+    assert new_top.named_args[1][1] is other
+    new_c = new_top.named_args[2][1]
+    assert new_c.pos_args[0] is other
+    assert new_c.pos_args[1] is new_top.named_args[0][1].pos_args[0]
+    new_nodes = set(dfs(new_top)) - set(dfs(top))
+    assert len(new_nodes) == 5   # -- Literal(5), mul, add, pos_args, dict
+
+
+def test_substitute_unrelated():
+    top = scope.add(1, 2)
+    assert substitute(top, {as_apply(3): 4}) is top
+    assert rec_eval(substitute(top, {top: 7})) == 7
+
+
+def test_placeholder_bindings():
+    x = scope.placeholder('x')
+    y = scope.placeholder('y')
+    expr = as_apply({'s': x * 2 + y, 'l': [x, 3]})
+    assert rec_eval(expr, bindings={'x': 1, 'y': 10}) == {'s': 12, 'l': (1, 3)}
+    assert rec_eval(expr, bindings={'x': 5, 'y': 0}) == {'s': 10, 'l': (5, 3)}
+    try:
+        rec_eval(expr, bindings={'x': 5})
+        assert False
+    except KeyError:
+        pass
+
+
+def test_vmap():
+    x = scope.placeholder('x')
+    y = scope.placeholder('y')
+    expr = scope.sqrt(x * x + y * y) + scope.add(1, 2)
+    xs = np.arange(5.)
+    ys = np.arange(5.) * 2
+    out = vmap(expr, {'x': xs, 'y': ys})
+    assert isinstance(out, np.ndarray)
+    assert np.allclose(out, np.sqrt(xs ** 2 + ys ** 2) + 3)
+    for ii in range(5):
+        assert np.allclose(out[ii],
+                rec_eval(expr, bindings={'x': xs[ii], 'y': ys[ii]}))
+
+
+def test_vmap_row_fallback():
+    x = scope.placeholder('x')
+    expr = as_apply({'d': x + 1, 'c': 7})
+    out = vmap(expr, {'x': np.arange(3)})
+    assert out == [{'d': 1, 'c': 7}, {'d': 2, 'c': 7}, {'d': 3, 'c': 7}]
+    assert vmap(scope.add(1, 1), {'x': [0, 0]}) == [2, 2]
+
+
+def test_vmap_shared_array():
+    x = scope.placeholder('x')
+    c = np.array([10, 20, 30])
+    for n in [2, 3]:
+        xs = np.arange(n)
+        out = vmap(scope.add(x, c), {'x': xs})
+        assert out.shape == (n, 3)
+        for ii in range(n):
+            assert np.all(out[ii] == rec_eval(x + c, bindings={'x': xs[ii]}))
+    # -- rows of different rank than the shared value
+    rows = np.arange(6.).reshape(3, 2)
+    out = vmap(scope.mul(x, np.array([[1.], [2.]])), {'x': rows})
+    assert out.shape == (3, 2, 2)
+    assert np.all(out[1] == rows[1] * np.array([[1.], [2.]]))
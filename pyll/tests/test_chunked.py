@@ -0,0 +1,80 @@
+import tempfile
+
+import numpy as np
+from pyll import scope, as_apply, rec_eval
+from pyll.chunked import rec_eval_chunked
+
+
+def _memmap(data):
+    mm = np.memmap(tempfile.TemporaryFile(), dtype=data.dtype, mode='w+',
+            shape=data.shape)
+    mm[:] = data
+    return mm
+
+
+rng = np.random.RandomState(0)
+x_data = rng.rand(1003)
+i_data = rng.randint(7, size=1003)
+
+
+def test_sum():
+    x = as_apply(_memmap(x_data))
+    val = rec_eval_chunked(scope.sum(scope.exp(x) * 2 + 1), chunk_size=100)
+    assert np.allclose(val, np.sum(np.exp(x_data) * 2 + 1))
+
+
+def test_reduction_feeds_expression():
+    x = as_apply(_memmap(x_data))
+    mean = scope.sum(x) / len(x_data)
+    var = scope.sum((x - mean) * (x - mean)) / len(x_data)
+    assert np.allclose(rec_eval_chunked(var, chunk_size=64), np.var(x_data))
+
+
+def test_bincount():
+    x = as_apply(_memmap(x_data))
+    i = as_apply(_memmap(i_data))
+    counts = rec_eval_chunked(scope.bincount(i, minlength=10), chunk_size=50)
+    assert list(counts) == list(np.bincount(i_data, minlength=10))
+    weighted = rec_eval_chunked(scope.bincount(i, weights=x), chunk_size=50)
+    assert np.allclose(weighted, np.bincount(i_data, weights=x_data))
+
+
+def test_materialize():
+    x = as_apply(_memmap(x_data))
+    val = rec_eval_chunked(scope.sqrt(x), chunk_size=100)
+    assert np.allclose(val, np.sqrt(x_data))
+    val = rec_eval_chunked(scope.getitem(x * 2, 5), chunk_size=100)
+    assert val == x_data[5] * 2
+
+
+def test_matches_rec_eval():
+    x = as_apply(_memmap(x_data))
+    expr = scope.sum(scope.log(x + 1) * x, axis=0)
+    assert np.allclose(rec_eval_chunked(expr, chunk_size=10), rec_eval(expr))
+
+
+def test_sum_negative_axis():
+    m_data = x_data[:12].reshape(4, 3)
+    m = as_apply(_memmap(m_data))
+    for axis in [0, 1, -1, -2, None]:
+        val = rec_eval_chunked(scope.sum(m * 2, axis=axis), chunk_size=3)
+        assert np.allclose(val, np.sum(m_data * 2, axis=axis))
+    x = as_apply(_memmap(x_data))
+    val = rec_eval_chunked(scope.sum(x, axis=-1), chunk_size=100)
+    assert np.allclose(val, np.sum(x_data))
+
+
+def test_in_memory_operands():
+    x = as_apply(_memmap(x_data))
+    i = as_apply(_memmap(i_data))
+    ramp = np.arange(len(x_data))
+    for expr in [scope.sum(x * ramp),
+            scope.bincount(i, weights=ramp * 1.0),
+            scope.bincount(i, weights=x * ramp),
+            scope.sum(x[:, None] * np.ones(3), axis=0)]:
+        assert np.allclose(rec_eval_chunked(expr, chunk_size=100),
+                rec_eval(expr))
+    # -- arrays that do not span the rows are broadcast as usual
+    m = as_apply(_memmap(x_data[:12].reshape(4, 3)))
+    expr = scope.sum(m * np.arange(3), axis=0)
+    assert np.allclose(rec_eval_chunked(expr, chunk_size=3), rec_eval(expr))
@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from pyll import scope, as_apply, rec_eval
+from pyll.diskcache import DiskCache
+
+_calls = []
+
+
+@scope.define
+def _test_expensive(n, scale=1.0):
+    _calls.append(n)
+    return np.arange(n) * scale
+
+
+@scope.define
+def _test_expensive_tuple(n):
+    _calls.append(n)
+    return ('x', n)
+
+
+def _with_cache(test):
+    def wrapper():
+        path = tempfile.mkdtemp()
+        try:
+            test(path)
+        finally:
+            shutil.rmtree(path)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@_with_cache
+def test_cache_hit_across_instances(path):
+    del _calls[:]
+    expr = scope.sum(scope._test_expensive(scope.add(5, 5), scale=2.0))
+    cache = DiskCache(path, ['_test_expensive'])
+    assert rec_eval(expr, cache=cache) == 90
+    assert rec_eval(expr, cache=cache) == 90
+    assert _calls == [10]
+    assert cache.hits == 1 and cache.misses == 1
+    # -- a new cache object on the same directory, as after a restart
+    cache2 = DiskCache(path, ['_test_expensive'])
+    val = rec_eval(scope._test_expensive(10, scale=2.0), cache=cache2)
+    assert isinstance(val, np.memmap)
+    assert list(val) == range(0, 20, 2)
+    assert _calls == [10]
+    # -- different input values miss
+    rec_eval(scope._test_expensive(10, scale=3.0), cache=cache2)
+    assert _calls == [10, 10]
+
+
+@_with_cache
+def test_cache_pickles_other_values(path):
+    del _calls[:]
+    cache = DiskCache(path, ['_test_expensive_tuple'])
+    expr = scope._test_expensive_tuple(3)
+    assert rec_eval(expr, cache=cache) == ('x', 3)
+    assert rec_eval(expr, cache=cache) == ('x', 3)
+    assert _calls == [3]
+
+
+@_with_cache
+def test_cache_eviction(path):
+    cache = DiskCache(path, ['_test_expensive'], max_bytes=3000)
+    for n in range(5):
+        rec_eval(scope._test_expensive(100 + n), cache=cache)
+    files = [f for f in os.listdir(path) if f.endswith('.npy')]
+    sizes = [os.path.getsize(os.path.join(path, f)) for f in files]
+    assert sum(sizes) <= 3000
+    assert 0 < len(files) < 5
+
+
+def _store_many(path, lo, hi):
+    cache = DiskCache(path, ['_test_expensive'], max_bytes=20000)
+    for n in range(lo, hi):
+        cache.store('key%i' % n, np.arange(100 + n))
+
+
+def _cache_files(path):
+    return [f for f in os.listdir(path) if f.endswith(('.npy', '.pkl'))]
+
+
+def _total_size(path):
+    return sum(os.path.getsize(os.path.join(path, f))
+            for f in _cache_files(path))
+
+
+@_with_cache
+def test_cache_size_file(path):
+    cache = DiskCache(path, ['_test_expensive'], max_bytes=10 ** 6)
+    scans = []
+    entries = cache._entries
+    def counting_entries():
+        scans.append(1)
+        return entries()
+    cache._entries = counting_entries
+    for n in range(5):
+        cache.store('key%i' % n, np.arange(10 + n))
+    # -- one scan for the missing size file, none while under max_bytes
+    assert len(scans) == 1
+    assert int(open(os.path.join(path, '.size')).read()) == _total_size(path)
+    cache.max_bytes = 1000
+    cache.store('big', np.arange(200))
+    assert len(scans) == 2
+    assert int(open(os.path.join(path, '.size')).read()) == _total_size(path)
+    assert _total_size(path) <= 1000
+    cache.clear()
+    assert _cache_files(path) == []
+
+
+@_with_cache
+def test_cache_processes(path):
+    import multiprocessing
+    procs = [multiprocessing.Process(target=_store_many,
+        args=(path, 10 * ii, 10 * ii + 10)) for ii in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+    names = os.listdir(path)
+    assert not [f for f in names if f.endswith('.tmp')]
+    assert 0 < len(_cache_files(path)) < 40
+    assert _total_size(path) <= 20000
+    cache = DiskCache(path, ['_test_expensive'], max_bytes=20000)
+    assert cache._read_total() == _total_size(path)
+    for f in _cache_files(path):
+        n = int(f[len('key'):-len('.npy')])
+        assert list(cache.load('key%i' % n)) == range(100 + n)
+
+
+@_with_cache
+def test_cache_lock_and_rename(path):
+    import multiprocessing
+    import time
+    cache = DiskCache(path, ['_test_expensive'])
+    with cache._lock():
+        proc = multiprocessing.Process(target=_store_many,
+                args=(path, 0, 1))
+        proc.start()
+        for ii in range(200):
+            if [f for f in os.listdir(path) if f.endswith('.tmp')]:
+                break
+            time.sleep(0.01)
+        # -- written to a temporary file, but not renamed into place
+        #    while another process holds the lock
+        assert [f for f in os.listdir(path) if f.endswith('.tmp')]
+        time.sleep(0.1)
+        assert _cache_files(path) == []
+    proc.join()
+    assert proc.exitcode == 0
+    assert _cache_files(path) == ['key0.npy']
+    assert not [f for f in os.listdir(path) if f.endswith('.tmp')]
+
+
+class _Unpicklable(object):
+    def __reduce__(self):
+        raise TypeError('cannot pickle')
+
+
+@_with_cache
+def test_cache_failed_store(path):
+    cache = DiskCache(path, ['_test_expensive'])
+    try:
+        cache.store('bad', _Unpicklable())
+    except TypeError:
+        pass
+    else:
+        assert False
+    assert [f for f in os.listdir(path) if not f.startswith('.')] == []
@@ -0,0 +1,80 @@
+import numpy as np
+from pyll import scope, as_apply
+from pyll.infer import infer, allocate, broadcast_shapes
+
+
+def test_infer_arithmetic():
+    x = as_apply(np.zeros((4, 3), dtype='float32'))
+    y = as_apply(np.arange(3))
+    expr = scope.exp(x + y) * 2
+    info = infer(expr)[expr]
+    assert info.shape == (4, 3)
+    assert info.dtype == np.dtype('float64')
+    out = allocate(info)
+    assert out.shape == (4, 3)
+    s = scope.sum(x, axis=0)
+    assert infer(s)[s].shape == (3,)
+    s = scope.sum(x)
+    assert infer(s)[s].shape == ()
+
+
+def test_infer_containers():
+    u = scope.uniform(0, 1, size=(5,))
+    d = as_apply({'a': u, 'b': [scope.randint(3, size=2), 'x']})
+    infos = infer(d)
+    assert infos[d].o_len == 2
+    b = d['b']
+    assert infer(b)[b].o_len == 2
+    r = d['b'][0]
+    info = infer(r)[r]
+    assert info.shape == (2,) and info.dtype.kind == 'i'
+    a = scope.getitem(d, 'a') + 1
+    info = infer(a)[a]
+    assert info.shape == (5,) and info.dtype == np.dtype(float)
+    assert scope.dict(a=1, b=2).o_len == 2
+
+
+def test_infer_constant_folding():
+    n = scope.add(2, 3)
+    u = scope.normal(0, 1, size=scope.pos_args(n, 2))
+    info = infer(u)[u]
+    assert info.shape == (5, 2)
+
+
+def test_infer_shape_errors():
+    x = as_apply(np.zeros(4))
+    y = as_apply(np.zeros(3))
+    for bad in [x + y,
+            scope.uniform(np.zeros(4), 1, size=(3,)),
+            scope.normal(np.zeros((2, 3)), 1, size=(3,)),
+            scope.randint(np.array([3, 4]), size=(3,)),
+            scope.uniform(np.zeros(3), 1),
+            scope.categorical(np.ones((2, 2)) / 2),
+            scope.getitem(as_apply([1, 2]), 2),
+            scope.sum(x, axis=1)]:
+        try:
+            infer(bad)
+        except ValueError:
+            pass
+        else:
+            assert False, bad
+
+
+def test_broadcast_shapes():
+    assert broadcast_shapes(None, (4, 1), (3,)) == (4, 3)
+    assert broadcast_shapes(None, (), (2,)) == (2,)
+    assert broadcast_shapes(None, None, (2,)) is None
+
+
+def test_infer_stochastic_param_shapes():
+    from pyll.stochastic import sample
+    rng = np.random.RandomState(0)
+    for node, shape in [
+            (scope.randint(np.array([3, 4])), (2,)),
+            (scope.randint(np.array([3, 4]), size=(5, 2)), (5, 2)),
+            (scope.uniform([0, 0, 0], 1, size=3), (3,)),
+            (scope.normal(np.zeros(3), 1, size=(2, 3)), (2, 3)),
+            (scope.categorical([.5, .5], size=(4,)), (4,))]:
+        info = infer(node)[node]
+        assert info.shape == shape, (node, info)
+        assert np.shape(sample(node, rng)) == shape
@@ -0,0 +1,65 @@
+import numpy as np
+from pyll import scope, as_apply, dfs, rec_eval
+from pyll.base import fingerprint
+from pyll.ir import GraphArrays
+
+
+def _space():
+    u = scope.uniform(0, 1)
+    shared = scope.add(1, 2)
+    return as_apply({'a': shared * u, 'b': shared + 3, 'c': [u, 'x']})
+
+
+def test_roundtrip():
+    expr = _space()
+    ga = GraphArrays.from_apply(expr)
+    assert len(ga) == len(dfs(expr))
+    expr2 = ga.to_apply()
+    assert expr2 is not expr
+    assert fingerprint(expr2) == fingerprint(expr)
+
+
+def test_roundtrip_eval():
+    expr = as_apply([scope.add(1, 2), scope.mul(3, scope.sub(5, 1))])
+    assert rec_eval(GraphArrays.from_apply(expr).to_apply()) == (3, 12)
+
+
+def test_depth_and_toposort():
+    expr = _space()
+    ga = GraphArrays.from_apply(expr)
+    nodes = dfs(expr)
+    depth = ga.depth()
+    expected = {}
+    for node in nodes:
+        inputs = node.inputs()
+        expected[node] = 1 + max(expected[i] for i in inputs) if inputs else 0
+    assert list(depth) == [expected[node] for node in nodes]
+    position = np.empty(len(ga), dtype=int)
+    position[ga.toposort()] = np.arange(len(ga))
+    consumers = ga.edge_consumers()
+    assert np.all(position[ga.input_indices] < position[consumers])
+
+
+def test_consumer_counts():
+    a = scope.add(1, 2)
+    expr = as_apply([scope.mul(a, a), a])
+    ga = GraphArrays.from_apply(expr)
+    nodes = dfs(expr)
+    counts = ga.consumer_counts()
+    assert counts[nodes.index(a)] == 2
+    assert counts[ga.root] == 0
+
+
+def test_reachable_and_stochastic():
+    expr = _space()
+    ga = GraphArrays.from_apply(expr)
+    nodes = dfs(expr)
+    assert ga.reachable().all()
+    b = expr.named_args[1][1]
+    reach_b = ga.reachable([nodes.index(b)])
+    assert set(n for n, r in zip(nodes, reach_b) if r) == set(dfs(b))
+    dep = ga.stochastic_dependents()
+    names = dict((n.name, d) for n, d in zip(nodes, dep) if n.name != 'literal')
+    assert names['uniform'] and names['mul'] and names['dict']
+    assert not names['add']
+    assert not dep[nodes.index(b)]
@@ -78,3 +78,290 @@ def test_qlognormal_never_0():
     results = [rec_eval(s) for i in range(100)]
     assert min(results) == 0.1
     assert max(results) != 0.1
+
+
+def test_log_prob_uniform():
+    u = scope.uniform(2, 6)
+    lp = log_prob(u, {u: [1.0, 3.0, 5.5]})
+    assert lp[0] == -np.inf
+    assert np.allclose(lp[1:], -np.log(4))
+
+
+def test_log_prob_quantized_sums_to_one():
+    for node, support in [
+            (scope.quniform(0, 10, 3), np.arange(0, 13, 3.)),
+            (scope.qnormal(0, 2, 0.5), np.arange(-20, 20.5, 0.5)),
+            (scope.qloguniform(0, 2, 0.5), np.arange(0.5, 8, 0.5)),
+            (scope.qlognormal(0, 1, 0.5), np.arange(0.5, 100, 0.5)),
+            (scope.randint(4), np.arange(4)),
+            (scope.categorical([.1, .6, .3]), np.arange(3)),
+            ]:
+        total = np.exp(log_prob(node, {node: support})).sum()
+        assert np.allclose(total, 1.0), (node.name, total)
+
+
+def test_log_prob_one_of():
+    n = scope.normal(0, 1)
+    u = scope.uniform(0, 1)
+    c = scope.one_of(n, u)
+    l = scope.lognormal(0, 1)
+    aa = as_apply({'c': c, 'l': l})
+    lp = log_prob(aa, {
+            c: [0, 1, 1],
+            n: [0.5, np.nan, np.nan],
+            u: [-9, 0.25, 2.0],
+            l: [1.0, 1.0, 1.0]})
+    lp_l = -0.5 * np.log(2 * np.pi)
+    lp_n = -0.125 - 0.5 * np.log(2 * np.pi)
+    assert np.allclose(lp[0], np.log(.5) + lp_l + lp_n)
+    assert np.allclose(lp[1], np.log(.5) + lp_l)
+    assert lp[2] == -np.inf
+
+
+def test_log_prob_dependent_parameters():
+    u = scope.uniform(0, 1)
+    v = scope.uniform(0, u)
+    lp = log_prob(v, {u: [0.5, 0.25], v: [0.1, 0.1]})
+    assert np.allclose(lp, [np.log(2), np.log(4)])
+
+
+def test_log_prob_dependent_parameters_size():
+    u = scope.uniform(1, 2)
+    v = scope.normal(u, 1, size=(2,))
+    x = np.array([[1., 2.], [0., 0.], [3., 1.]])
+    us = np.array([1.5, 1.25, 1.75])
+    lp = log_prob(v, {u: us, v: x})
+    expected = (-0.5 * (x - us[:, None]) ** 2
+            - 0.5 * np.log(2 * np.pi)).sum(axis=1)
+    assert np.allclose(lp, expected)
+
+
+def test_log_prob_one_of_parameter():
+    c = scope.one_of(1, 2)
+    v = scope.uniform(0, c)
+    lp = log_prob(v, {c: [0, 1, 1], v: [0.5, 0.5, 1.5]})
+    assert np.allclose(lp, np.log(.5) + np.log([1., .5, .5]))
+    # -- the parameter of a branch only needs the branches that are used
+    w = scope.normal(0, 1)
+    d = scope.one_of(scope.uniform(0, 1), w + 1)
+    z = scope.uniform(0, d)
+    lp = log_prob(z, {d: [0, 0], z: [0.25, 0.4], d.pos_args[0]: [.5, .5]})
+    assert np.allclose(lp, np.log(.5) + np.log(2))
+
+
+def test_sample_key():
+    assert sample_key((1, {'a': 2.0})) == sample_key((1, {'a': 2.0}))
+    assert sample_key((1, {'a': 2.0})) != sample_key((1, {'a': 3.0}))
+    assert sample_key(np.arange(3)) == sample_key(np.arange(3))
+
+
+def test_bloom_filter():
+    bf = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = np.random.RandomState(1).randint(-2 ** 62, 2 ** 62, size=2000)
+    assert not bf.contains(keys[:1000]).any()
+    bf.add(keys[:1000])
+    assert bf.contains(keys[:1000]).all()
+    assert bf.contains(keys[1000:]).mean() < 0.05
+
+
+def test_dedup_sampler():
+    space = as_apply([scope.randint(3), scope.one_of('a', 'b')])
+    sampler = DedupSampler(space, np.random.RandomState(2))
+    draws = [sampler.sample() for ii in range(6)]
+    assert len(set((int(a), b) for a, b in draws)) == 6
+    try:
+        sampler.sample()
+        assert False
+    except RuntimeError:
+        pass
+
+
+def test_dedup_sampler_batch():
+    space = scope.quniform(0, 10, 1)
+    sampler = DedupSampler(space, np.random.RandomState(2),
+            index=BloomFilter(capacity=100))
+    first = sampler.sample_batch(50)
+    assert len(set(first)) == len(first) <= 10
+    second = sampler.sample_batch(50)
+    assert not set(first) & set(second)
+
+
+def test_sample_at():
+    u = scope.uniform(0, 1)
+    aa = as_apply(dict(
+                u = u,
+                n = scope.normal(5, 0.1),
+                l = [0, 1, scope.one_of(2, 3), u]))
+    forward = [sample_at(aa, 5, ii) for ii in range(5)]
+    backward = [sample_at(aa, 5, ii) for ii in reversed(range(5))][::-1]
+    assert forward == backward
+    assert len(set(float(dd['u']) for dd in forward)) == 5
+    assert forward[0]['u'] == forward[0]['l'][3]
+    assert sample_at(aa, 6, 0) != forward[0]
+    far = sample_at(aa, 5, 10 ** 6)
+    assert far == sample_at(aa, 5, 10 ** 6)
+
+
+def test_sample_at_independent_streams():
+    # -- two nodes with the same distribution must not draw the same values
+    aa = as_apply([scope.uniform(0, 1), scope.uniform(0, 1)])
+    a, b = sample_at(aa, 0, 0)
+    assert a != b
+
+
+def test_sample_batch():
+    u = scope.uniform(0, 1)
+    aa = as_apply(dict(
+                u = u,
+                n = scope.normal(5, 0.1),
+                l = [0, 1, scope.one_of(2, 3), u]))
+    dds = sample_batch(aa, np.random.RandomState(3), 50)
+    assert len(dds) == 50
+    for dd in dds:
+        assert 0 < dd['u'] < 1
+        assert 4 < dd['n'] < 6
+        assert dd['u'] == dd['l'][3]
+        assert dd['l'][:2] == (0, 1)
+        assert dd['l'][2] in (2, 3)
+    assert len(set(dd['l'][2] for dd in dds)) == 2
+    assert len(set(float(dd['u']) for dd in dds)) == 50
+
+
+def test_ragged_eval_routes_rows():
+    u = scope.uniform(0, 1)
+    n = scope.normal(0, 1) + 100
+    c = scope.one_of(u, n, 'const')
+    foo = recursive_set_rng_kwarg(as_apply(c),
+            as_apply(np.random.RandomState(1)))
+    memo, choices = ragged_eval(foo, 300)
+    choice = choices[c]
+    u_idxs, u_vals = memo[u]
+    n_idxs, n_vals = memo[n]
+    # -- each branch is evaluated only for the rows that selected it
+    assert list(u_idxs) == list(np.where(choice == 0)[0])
+    assert list(n_idxs) == list(np.where(choice == 1)[0])
+    assert len(u_vals) == len(u_idxs)
+    idxs, vals = memo[c]
+    assert list(idxs) == range(300)
+    for ii in range(300):
+        if choice[ii] == 0:
+            assert 0 < vals[ii] < 1
+        elif choice[ii] == 1:
+            assert 90 < vals[ii] < 110
+        else:
+            assert vals[ii] == 'const'
+
+
+def test_ragged_eval_dependent_parameters():
+    u = scope.uniform(0, 1)
+    v = scope.uniform(u, u + 1, size=(2,))
+    k = scope.randint(scope.int(u * 10) + 1)
+    foo = recursive_set_rng_kwarg(as_apply([u, v, k]),
+            as_apply(np.random.RandomState(1)))
+    memo, choices = ragged_eval(foo, 20)
+    for uu, vv, kk in memo[foo][1]:
+        assert vv.shape == (2,)
+        assert np.all(uu <= vv) and np.all(vv <= uu + 1)
+        assert 0 <= kk <= int(uu * 10)
+
+
+def test_lhs_uniforms():
+    u = lhs_uniforms(np.random.RandomState(0), 10, (3,))
+    assert u.shape == (10, 3)
+    for col in u.T:
+        assert sorted(np.floor(col * 10).astype('int')) == range(10)
+
+
+def test_normal_ppf():
+    u = np.array([1e-10, 0.001, 0.02, 0.3, 0.5, 0.9, 0.999])
+    x = normal_ppf(u)
+    assert np.allclose(0.5 * (1 + erf(x / np.sqrt(2))), u, rtol=1e-6)
+
+
+def test_sample_lhs_strata():
+    n = 50
+    space = as_apply({
+        'u': scope.uniform(-1, 3),
+        'lu': scope.loguniform(0, 2),
+        'qu': scope.quniform(0, 10, 2),
+        'no': scope.normal(0, 1),
+        'k': scope.categorical([0.1, 0.4, 0.5]),
+        'r': scope.randint(5),
+        })
+    samples = sample_lhs(space, np.random.RandomState(1), n)
+    u = np.array([s['u'] for s in samples])
+    assert sorted(np.floor((u + 1) / 4 * n).astype('int')) == range(n)
+    lu = np.log([s['lu'] for s in samples])
+    assert sorted(np.floor(lu / 2 * n).astype('int')) == range(n)
+    qu = np.array([s['qu'] for s in samples])
+    assert set(qu) <= set([0, 2, 4, 6, 8, 10])
+    assert np.all(np.bincount((qu / 2).astype('int'))[1:] == 10)
+    no = np.array([s['no'] for s in samples])
+    strata = 0.5 * (1 + erf(no / np.sqrt(2))) * n
+    assert sorted(np.floor(strata).astype('int')) == range(n)
+    k = np.array([int(s['k']) for s in samples])
+    assert list(np.bincount(k)) == [5, 20, 25]
+    r = np.array([int(s['r']) for s in samples])
+    assert list(np.bincount(r)) == [10] * 5
+
+
+def test_sample_lhs_branches():
+    u = scope.uniform(0, 1)
+    space = scope.one_of(u, scope.uniform(5, 6, size=(2,)), 'none')
+    memo = {}
+    foo = recursive_set_rng_kwarg(clone(space, memo),
+            as_apply(np.random.RandomState(0)))
+    values, choices = ragged_eval(foo, 30, draw=stratified_draw)
+    assert list(np.bincount(choices[foo])) == [10, 10, 10]
+    idxs, vals = values[memo[u]]
+    assert len(idxs) == 10
+    assert sorted(np.floor(vals * 10).astype('int')) == range(10)
+    samples = sample_lhs(space, np.random.RandomState(0), 30)
+    assert sum(1 for s in samples if s == 'none') == 10
+    pairs = np.array([s for s in samples if np.shape(s) == (2,)])
+    for col in pairs.T:
+        assert sorted(np.floor((col - 5) * 10).astype('int')) == range(10)
+
+
+def test_recursive_set_rng_kwarg_no_index():
+    a = scope.uniform(0, 1) + 2
+    recursive_set_rng_kwarg(a, np.random.RandomState(0))
+    assert not hasattr(a, '_graph_index')
+    assert 2 < rec_eval(a) < 3
+
+
+def test_sample_batch_shared_array():
+    c = np.array([10., 20., 30.])
+    for n in [3, 4]:
+        samples = sample_batch(scope.uniform(0, 1) + c,
+                np.random.RandomState(0), n)
+        assert len(samples) == n
+        for s in samples:
+            assert np.shape(s) == (3,)
+            assert np.allclose(s - c, s[0] - c[0])
+    space = scope.one_of(scope.uniform(0, 1) * c, 'none')
+    samples = sample_batch(space, np.random.RandomState(0), 10)
+    arrays = [s for s in samples if not isinstance(s, basestring)]
+    assert arrays
+    for s in arrays:
+        assert np.shape(s) == (3,)
+        assert np.allclose(s / c, s[0] / c[0])
+
+
+def test_sample_batch_mixed_branches():
+    space = scope.one_of(scope.uniform(0, 1), scope.normal(5, 1, size=2))
+    samples = sample_batch(space, np.random.RandomState(0), 20)
+    shapes = set(np.shape(s) for s in samples)
+    assert shapes == set([(), (2,)])
+    ints = sample_batch(scope.one_of(scope.uniform(0, 1), scope.randint(10)),
+            np.random.RandomState(0), 20)
+    kinds = set(np.asarray(s).dtype.kind for s in ints)
+    assert kinds == set(['f', 'i'])
+    for s in ints:
+        if np.asarray(s).dtype.kind == 'i':
+            assert 0 <= s < 10
+    lhs = sample_lhs(space, np.random.RandomState(0), 20)
+    assert set(np.shape(s) for s in lhs) == set([(), (2,)])
+    from pyll.summary import summarize
+    report = summarize(space, np.random.RandomState(0), 100, chunk_size=30)
+    assert report[space].n_active == 100
@@ -0,0 +1,128 @@
+import threading
+
+import numpy as np
+from pyll import scope, as_apply, rec_eval
+from pyll.stream import Pipeline
+
+
+def test_pipeline_matches_rec_eval():
+    x = scope.identity(0)
+    y = scope.identity(0)
+    expr = as_apply({'s': x + y * scope.sqrt(16), 'x': x, 'c': scope.add(1, 2)})
+    pipe = Pipeline(expr, inputs=[x, y])
+    records = [(1, 2), (3, 4), {x: 5, y: 6}]
+    outs = list(pipe.run(records))
+    assert outs == [{'s': 9.0, 'x': 1, 'c': 3},
+                    {'s': 19.0, 'x': 3, 'c': 3},
+                    {'s': 29.0, 'x': 5, 'c': 3}]
+    assert outs[0] == rec_eval(expr, memo={x: 1, y: 2})
+    assert not pipe.batchable
+
+
+def test_pipeline_micro_batches():
+    x = scope.identity(0)
+    expr = scope.log(x * 2 + 1)
+    pipe = Pipeline(expr, inputs=[x], batch_size=4)
+    assert pipe.batchable
+    outs = list(pipe.run((float(ii),) for ii in range(10)))
+    assert np.allclose(outs, np.log(np.arange(10) * 2 + 1))
+
+
+def test_pipeline_backpressure():
+    x = scope.identity(0)
+    pipe = Pipeline(x + 1, inputs=[x], buffer_size=3)
+    produced = []
+    consumed = []
+    lock = threading.Lock()
+
+    def records():
+        for ii in range(20):
+            with lock:
+                produced.append(ii)
+            yield (ii,)
+
+    for out in pipe.run(records()):
+        with lock:
+            consumed.append(out)
+            # -- queue of 3 + one item blocked in put + one being consumed
+            assert len(produced) - len(consumed) <= 5
+    assert consumed == range(1, 21)
+
+
+def test_pipeline_propagates_errors():
+    x = scope.identity(0)
+    pipe = Pipeline(x + 1, inputs=[x], buffer_size=2)
+
+    def records():
+        yield (1,)
+        raise KeyError('bad record')
+    outs = []
+    try:
+        for out in pipe.run(records()):
+            outs.append(out)
+        assert False
+    except KeyError:
+        pass
+    assert outs == [2]
+
+
+def test_pipeline_placeholders():
+    x = scope.placeholder('x')
+    y = scope.placeholder('y')
+    pipe = Pipeline(x * 10 + y, inputs=['x', 'y'], batch_size=2)
+    outs = list(pipe.run([(1, 2), {'x': 3, 'y': 4}, (5, 6)]))
+    assert outs == [12, 34, 56]
+
+
+def test_pipeline_batch_size_invariant():
+    x = scope.placeholder('x')
+    expr = scope.mul(x, np.array([1., 2.]))
+    records = [(1.,), (2.,), (3.,)]
+    single = list(Pipeline(expr, inputs=['x'], batch_size=1).run(records))
+    for batch_size in [2, 3]:
+        pipe = Pipeline(expr, inputs=['x'], batch_size=batch_size)
+        assert pipe.batchable
+        outs = list(pipe.run(records))
+        assert len(outs) == 3
+        for a, b in zip(outs, single):
+            assert np.all(a == b) and np.shape(a) == (2,)
+
+
+def test_pipeline_stops_reader():
+    import itertools
+    import time
+    x = scope.placeholder('x')
+    before = threading.active_count()
+    outs = Pipeline(x + 1, inputs=['x'], buffer_size=2).run(
+            (ii,) for ii in itertools.count())
+    assert next(outs) == 1
+    outs.close()
+    for ii in range(100):
+        if threading.active_count() == before:
+            break
+        time.sleep(0.01)
+    assert threading.active_count() == before
+
+
+def test_pipeline_duplicate_inputs():
+    x = scope.placeholder('x')
+    try:
+        Pipeline(x + 1, inputs=['x', 'x'])
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_pipeline_batch_types():
+    x = scope.placeholder('x')
+    records = [(ii,) for ii in range(5)]
+    for batch_size in [1, 4]:
+        outs = list(Pipeline(x * 2 + 1, inputs=['x'],
+            batch_size=batch_size).run(records))
+        assert outs == [1, 3, 5, 7, 9]
+        assert set(type(out) for out in outs) == set([int])
+        names = list(Pipeline(x, inputs=['x'], batch_size=batch_size).run(
+            [('a',), ('b',)]))
+        assert names == ['a', 'b'] and type(names[0]) is str
+    assert not Pipeline(x, inputs=['x']).batchable
@@ -0,0 +1,62 @@
+import numpy as np
+from pyll import scope, as_apply
+from pyll.summary import summarize, Moments, TDigest, Counts
+
+
+def test_moments():
+    rng = np.random.RandomState(0)
+    x = rng.randn(1000) * 3 + 2
+    m = Moments()
+    for chunk in np.array_split(x, 7):
+        m.update(chunk)
+    assert m.n == 1000
+    assert np.allclose(m.mean, x.mean())
+    assert np.allclose(m.var, x.var(ddof=1))
+
+
+def test_tdigest():
+    rng = np.random.RandomState(0)
+    x = rng.lognormal(size=50000)
+    d = TDigest(compression=100)
+    for chunk in np.array_split(x, 20):
+        d.update(chunk)
+    assert len(d.means) <= 100
+    qs = [0.01, 0.1, 0.5, 0.9, 0.99]
+    exact = np.percentile(x, np.asarray(qs) * 100)
+    assert np.allclose(d.quantile(qs), exact, rtol=0.03)
+    assert d.quantile(0) == x.min() and d.quantile(1) == x.max()
+
+
+def test_counts():
+    c = Counts()
+    c.update([0, 2, 2])
+    c.update([5])
+    assert list(c.counts) == [1, 0, 2, 0, 0, 1]
+
+
+def test_summarize():
+    u = scope.uniform(0, 1)
+    n = scope.normal(5, 2)
+    c = scope.one_of(n, 'none', 'none', 'none')
+    k = scope.categorical([0.2, 0.8])
+    space = as_apply({'u': u, 'c': c, 'k': k})
+    report = summarize(space, np.random.RandomState(0), 20000,
+            chunk_size=3000)
+    assert report.n_samples == 20000
+    assert set(report.nodes) == set([u, n, c, k])
+    su = report[u]
+    assert su.n_active == 20000
+    assert abs(su.moments.mean - 0.5) < 0.01
+    assert abs(su.moments.var - 1 / 12.) < 0.005
+    assert np.allclose(su.digest.quantile([.1, .5, .9]), [.1, .5, .9],
+            atol=0.02)
+    sc = report[c]
+    assert np.allclose(sc.counts.frequencies(), [.25] * 4, atol=0.02)
+    sn = report[n]
+    # -- normal is only drawn when its branch is selected
+    assert sn.n_active == sc.counts.counts[0]
+    assert abs(sn.moments.mean - 5) < 0.1
+    assert abs(sn.moments.std - 2) < 0.1
+    assert np.allclose(report[k].counts.frequencies(), [.2, .8], atol=0.02)
+    text = str(report)
+    assert 'one_of active=1.000' in text
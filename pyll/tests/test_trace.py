@@ -0,0 +1,46 @@
+import json
+from StringIO import StringIO
+
+import numpy as np
+from pyll import scope, as_apply, rec_eval
+from pyll.trace import Tracer
+
+
+def test_tracer_spans():
+    a = scope.add(1, 2)
+    b = scope.asarray([a, a, 4])
+    c = scope.sum(b)
+    tracer = Tracer()
+    assert rec_eval(c, tracer=tracer) == 10
+    names = [span.name for span in tracer.spans]
+    assert names == ['add', 'pos_args', 'asarray', 'sum']
+    depths = dict((span.name, span.depth) for span in tracer.spans)
+    assert depths == {'add': 1, 'pos_args': 2, 'asarray': 3, 'sum': 4}
+    sizes = dict((span.name, span.size) for span in tracer.spans)
+    assert sizes['asarray'] == 3
+    assert sizes['add'] is None
+    assert all(span.end >= span.start for span in tracer.spans)
+
+
+def test_tracer_critical_path():
+    ticks = iter(range(100))
+    tracer = Tracer(clock=lambda: ticks.next())
+    slow = scope.exp(1.0)
+    fast = scope.add(1, 2)
+    top = as_apply([slow, fast])
+    rec_eval(top, tracer=tracer)
+    # -- every span lasts one tick, so the path is the longest chain
+    path = [span.name for span in tracer.critical_path()]
+    assert len(path) == 2 and path[-1] == 'pos_args'
+
+
+def test_tracer_chrome_json():
+    tracer = Tracer()
+    rec_eval(scope.add(1, scope.mul(2, 3)), tracer=tracer)
+    sio = StringIO()
+    tracer.dump(sio)
+    trace = json.loads(sio.getvalue())
+    events = trace['traceEvents']
+    assert [ev['name'] for ev in events] == ['mul', 'add']
+    assert all(ev['ph'] == 'X' and ev['dur'] >= 0 for ev in events)
+    assert all(ev['args']['critical'] for ev in events)
@@ -0,0 +1,128 @@
+"""
+Timeline tracing of graph evaluation.
+
+    >>> tracer = Tracer()
+    >>> rec_eval(expr, tracer=tracer)
+    >>> tracer.dump(open('trace.json', 'w'))
+
+The resulting file can be loaded in a trace-event viewer such as
+chrome://tracing or Perfetto.
+"""
+import json
+import os
+import thread
+import time
+from collections import namedtuple
+
+import numpy as np
+
+Span = namedtuple('Span', 'node name depth start end size pid tid')
+
+
+def output_size(obj):
+    """Number of elements of a node's output, or None if it has no length
+    """
+    if isinstance(obj, np.ndarray):
+        return int(obj.size)
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+class Tracer(object):
+    """
+    Record a Span (start, end, worker, depth, output size) per node call.
+
+    Pass an instance as the `tracer` argument of rec_eval / rec_eval_many.
+    A tracer can be shared by several evaluations, also from several
+    threads; the spans accumulate in `self.spans`.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.spans = []
+        self._depth = {}
+
+    def start(self, nodes):
+        """Called by rec_eval with the nodes it is about to evaluate,
+        in topological order.
+        """
+        depth = self._depth
+        for node in nodes:
+            if node not in depth:
+                inputs = node.inputs()
+                if inputs:
+                    depth[node] = 1 + max(depth[ii] for ii in inputs)
+                else:
+                    depth[node] = 0
+
+    def call(self, node, f, args, kwargs):
+        """Return f(*args, **kwargs), recording a span for node
+        """
+        start = self.clock()
+        rval = None
+        try:
+            rval = f(*args, **kwargs)
+            return rval
+        finally:
+            end = self.clock()
+            self.spans.append(Span(node, node.name, self._depth.get(node),
+                start, end, output_size(rval), os.getpid(),
+                thread.get_ident()))
+
+    def critical_path(self):
+        """Return the chain of spans, linked by data dependencies, with the
+        largest total duration, ordered from its first to its last span.
+        """
+        latest = {}
+        cost = []
+        pred = []
+        for ii, span in enumerate(self.spans):
+            best = None
+            for arg in span.node.inputs():
+                jj = latest.get(arg)
+                if jj is not None and (best is None or cost[jj] > cost[best]):
+                    best = jj
+            own = span.end - span.start
+            cost.append(own + (cost[best] if best is not None else 0))
+            pred.append(best)
+            latest[span.node] = ii
+        if not cost:
+            return []
+        # -- on ties prefer the later span, which extends the earlier ones
+        ii = len(cost) - 1 - int(np.argmax(cost[::-1]))
+        rval = []
+        while ii is not None:
+            rval.append(self.spans[ii])
+            ii = pred[ii]
+        return rval[::-1]
+
+    def to_chrome_trace(self):
+        """Return the spans as a Chrome trace-event dictionary
+        """
+        if not self.spans:
+            return {'traceEvents': []}
+        t0 = min(span.start for span in self.spans)
+        critical = set(id(span) for span in self.critical_path())
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span.name,
+                'cat': 'pyll',
+                'ph': 'X',
+                'ts': (span.start - t0) * 1e6,
+                'dur': (span.end - span.start) * 1e6,
+                'pid': span.pid,
+                'tid': span.tid,
+                'args': {
+                    'depth': span.depth,
+                    'size': span.size,
+                    'critical': id(span) in critical,
+                    }})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, ofile):
+        """Write the Chrome trace-event JSON to the file object ofile
+        """
+        json.dump(self.to_chrome_trace(), ofile)